@@ -0,0 +1,93 @@
+#! /usr/bin/env python3
+"""time to first instruction, measured in fresh interpreters
+
+run from the repository root:
+
+    python bench/startup.py rom.gb                        # report
+    python bench/startup.py rom.gb --save bench/startup.json
+    python bench/startup.py rom.gb --baseline bench/startup.json
+
+with --baseline the exit status is 1 when startup regressed by more than
+--tolerance. numbers are only comparable on the machine that saved them.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = """
+import json, sys, time
+t0 = time.perf_counter()
+from libgb.gameboy import Gameboy
+from libgb.lcd import SINKS
+from libgb.rom import Rom
+t1 = time.perf_counter()
+gb = Gameboy.from_rom(Rom.from_file(sys.argv[1]), SINKS[sys.argv[2]](), sys.argv[3])
+t2 = time.perf_counter()
+gb.run_cycles(1)
+t3 = time.perf_counter()
+assert gb.cpu.execs == 1
+print(json.dumps({"import_ms": (t1 - t0) * 1000, "from_rom_ms": (t2 - t1) * 1000,
+                  "first_instr_ms": (t3 - t2) * 1000}))
+"""
+
+
+def timed(cmd):
+    start = time.perf_counter()
+    out = subprocess.run(cmd, cwd=ROOT, check=True, stdout=subprocess.PIPE).stdout
+    return (time.perf_counter() - start) * 1000, out
+
+
+def measure(rom: str, runs: int, display: str, renderer: str) -> dict:
+    bare, total, parts = [], [], []
+    for _ in range(runs):
+        bare.append(timed([sys.executable, "-c", "pass"])[0])
+        ms, out = timed([sys.executable, "-c", CHILD, rom, display, renderer])
+        total.append(ms)
+        parts.append(json.loads(out.decode().splitlines()[-1]))
+    bare_ms, total_ms = statistics.median(bare), statistics.median(total)
+    result = {
+        "display": display,
+        "renderer": renderer,
+        "runs": runs,
+        "interpreter_ms": bare_ms,
+        "total_ms": total_ms,
+        # what we add on top of starting python
+        "startup_ms": total_ms - bare_ms,
+    }
+    for key in parts[0]:
+        result[key] = statistics.median(p[key] for p in parts)
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("rom")
+    parser.add_argument("--runs", type=int, default=15)
+    parser.add_argument("--display", default="null")
+    parser.add_argument("--renderer", default="auto")
+    parser.add_argument("--save", help="write the result as the new baseline")
+    parser.add_argument("--baseline", help="compare against a saved result")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    result = measure(os.path.abspath(args.rom), args.runs, args.display, args.renderer)
+    print(json.dumps(result, indent=2))
+
+    if args.save:
+        with open(args.save, "w") as f:
+            f.write(json.dumps(result, indent=2) + "\n")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        ratio = result["startup_ms"] / baseline["startup_ms"]
+        print("startup: {:.1f} ms vs {:.1f} ms baseline ({:+.0%})".format(
+            result["startup_ms"], baseline["startup_ms"], ratio - 1))
+        if ratio > 1 + args.tolerance:
+            sys.exit(1)
@@ -1,31 +1,138 @@
 #! pypy3
 
 import argparse
-import cProfile
 import sys
 
 from libgb.gameboy import Gameboy
+from libgb.gpu import RENDERERS
+from libgb.joypad import ScriptedInput
+from libgb.lcd import SINKS, ImageSink
 from libgb.rom import Rom
 from libgb.instr import diag
 
 
-def main(rom_path: str, max_execs: int, headless: bool):
-    if not headless:
-        print("warning! display not supported")
+def print_serial(val: int):
+    print(chr(val), end="", flush=True)
+
+
+def main(rom_path: str, max_execs: int, display: str, screenshot: str = None,
+         renderer: str = "auto", wall_clock: bool = False, link: str = None,
+         link_quantum: int = None, record: str = None, play: str = None):
+    if screenshot is not None:
+        display = "image"
+    if display == "remote":
+        # the renderer runs in the render process
+        sink = SINKS[display](renderer)
+    else:
+        sink = SINKS[display]()
+
+    # the remote sink owns a render process and a shared memory block, so
+    # it's closed however the rest of the setup goes
+    cable = None
+    recorder = None
+    try:
+        rom = Rom.from_file(rom_path)
+        if play is not None:
+            from libgb.movie import MovieInput
+            inputs = MovieInput(play, rom.digest)
+        else:
+            inputs = sink.inputs()
+        if record is not None:
+            from libgb.movie import MovieRecorder
+            inputs = recorder = MovieRecorder(inputs or ScriptedInput())
+
+        gb = Gameboy.from_rom(rom, sink, renderer, wall_clock, inputs)
+        gb.cpu.max_execs = max_execs
+        gb.serial.observers.append(print_serial)
+
+        if link is not None:
+            from libgb.link import DEFAULT_QUANTUM, Link
+            if link == "new":
+                cable = Link.create(link_quantum or DEFAULT_QUANTUM)
+                print("link cable: {}".format(cable.name), flush=True)
+            else:
+                cable = Link.connect(link)
+            cable.attach(gb.serial, gb.sched)
+
+        gb.run()
+    finally:
+        if cable is not None:
+            cable.close()
+        sink.close()
+        if recorder is not None:
+            recorder.save(record, rom.digest)
+
+    if isinstance(sink, ImageSink) and screenshot is not None:
+        sink.save(screenshot)
+
+
+def test_main(rom_path: str, max_cycles: int) -> int:
+    from libgb.lcd import NullSink
+    from libgb.testrom import run_test_rom
 
     rom = Rom.from_file(rom_path)
-    gb = Gameboy.from_rom(rom)
-    gb.cpu.max_execs = max_execs
+    # verdicts shouldn't depend on .sav files left behind by earlier runs
+    rom.path = None
+    gb = Gameboy.from_rom(rom, NullSink())
+    gb.serial.observers.append(print_serial)
+    result = run_test_rom(gb, max_cycles)
+    gb.tcache.save()
+    print()
+    print("{}: {} after {} cycles".format(rom_path, result, gb.sched.now))
+    return 0 if result == "passed" else 1
 
-    gb.run()
+
+def batch_main(argv):
+    import json
+    from libgb.batch import make_jobs, run_batch
+
+    parser = argparse.ArgumentParser(prog="gb.py batch")
+    parser.add_argument("roms", help="directory of roms, or a manifest file")
+    parser.add_argument("--cycles", type=int, help="cycle budget per rom")
+    parser.add_argument("--frames", type=int, help="frame budget per rom")
+    parser.add_argument("--jobs", type=int, help="worker processes (default: all cores)")
+    parser.add_argument("--report", help="write the json report here instead of stdout")
+    args = parser.parse_args(argv)
+
+    try:
+        jobs = make_jobs(args.roms, args.cycles, args.frames)
+    except ValueError as e:
+        parser.error(str(e))
+    if any(job.cycles is None and job.frames is None for job in jobs):
+        parser.error("every rom needs a --cycles or --frames budget")
+
+    report = json.dumps(run_batch(jobs, args.jobs), indent=2)
+    if args.report:
+        with open(args.report, "w") as f:
+            f.write(report + "\n")
+    else:
+        print(report)
 
 
 if __name__ == "__main__":
+    if sys.argv[1:2] == ["batch"]:
+        batch_main(sys.argv[2:])
+        sys.exit(0)
+
     parser = argparse.ArgumentParser()
     parser.add_argument("rom")
     parser.add_argument("--max-execs", default="0")
     parser.add_argument("--prof", action="store_true")
     parser.add_argument("--headless", action="store_true")
+    parser.add_argument("--display", choices=sorted(SINKS), default="pygame")
+    parser.add_argument("--renderer", choices=RENDERERS, default="auto")
+    parser.add_argument("--screenshot", help="save the last frame as .png or .ppm")
+    parser.add_argument("--wall-clock", action="store_true",
+                        help="run the cart clock on host time instead of emulated time")
+    parser.add_argument("--link", metavar="NAME",
+                        help="plug into another gb.py's link cable, or 'new' to create one")
+    parser.add_argument("--link-quantum", type=int,
+                        help="max ticks either side of a new cable may run ahead")
+    parser.add_argument("--record", metavar="MOVIE", help="record the inputs of this run")
+    parser.add_argument("--play", metavar="MOVIE", help="take inputs from a recorded movie")
+    parser.add_argument("--test", action="store_true",
+                        help="run headless until the serial output reports passed/failed")
+    parser.add_argument("--max-cycles", type=int, help="give up on --test after this many cycles")
     parser.add_argument("--diag", action="store_true")
 
     args = parser.parse_args()
@@ -34,7 +141,14 @@ if __name__ == "__main__":
         diag()
         sys.exit(0)
 
+    if args.test:
+        sys.exit(test_main(args.rom, args.max_cycles))
+
+    display = "null" if args.headless else args.display
+
     if args.prof:
-        cProfile.run("main('{}', 0, True)".format(args.rom), sort="tottime")
+        import cProfile
+        cProfile.run("main('{}', 0, 'null')".format(args.rom), sort="tottime")
     else:
-        main(args.rom, int(args.max_execs), args.headless)
+        main(args.rom, int(args.max_execs), display, args.screenshot, args.renderer,
+             args.wall_clock, args.link, args.link_quantum, args.record, args.play)
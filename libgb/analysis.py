@@ -0,0 +1,323 @@
+from array import array
+from bisect import bisect_right
+import marshal
+import os
+import subprocess
+import sys
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from weakref import WeakKeyDictionary
+
+from .cpu import INTERRUPT_VECTOR
+from .instr import CALL, JP, JR, OP_LENGTH, OP_TABLE, RET, RETI, RST_START, unimplemented
+from .rom import BANK_SIZE, Rom
+from .tcache import TranslationCache
+
+# per-byte flags in analyze's code bitmaps
+INSTR = 1 << 0 # first byte of an instruction
+OPERAND = 1 << 1 # operand byte of an instruction
+BLOCK = 1 << 2 # an instruction that starts a block
+
+ENTRY = 0x100
+RST_VECTORS = [i * 8 for i in range(8)]
+
+JP_HL = 0xE9
+COND_JRS = [0x20, 0x28, 0x30, 0x38]
+COND_JPS = [0xC2, 0xCA, 0xD2, 0xDA]
+COND_CALLS = [0xC4, 0xCC, 0xD4, 0xDC]
+COND_RETS = [0xC0, 0xC8, 0xD0, 0xD8]
+RSTS = [RST_START + n for n in RST_VECTORS]
+
+# no fallthrough after these
+ENDS = {JR, JP, RET, RETI, JP_HL}
+# these end a block but execution may carry on after them
+BRANCHES = set(COND_JRS + COND_JPS + COND_CALLS + COND_RETS + RSTS + [CALL])
+
+# bank switches are spotted as `LD A,n` then `LD (nn),A` (or through
+# `LD HL,nn`) into the mbc's rom bank register
+BANK_SELECT_LO = 0x2000
+BANK_SELECT_HI = 0x3FFF
+LD_A_IMM = 0x3E
+LD_HL_IMM = 0x21
+LD_IMM16_A = 0xEA
+LD_HLp_A = 0x77
+LD_HLp_IMM = 0x36
+# instructions that leave A and HL alone, so what's known about them survives
+KEEPS_A_HL = {0x00, 0x01, 0x11, 0x06, 0x0E, 0x16, 0x1E, 0xE0, LD_IMM16_A, LD_HLp_A, LD_HLp_IMM}
+
+# the number goes up whenever Analysis changes shape
+KEY = ("analysis", 2)
+# the cache is keyed by the rom's hash already; the header is a cheap recheck
+SPANS = [(ENTRY, 0x50)]
+# an analysis lock older than this was left by a worker that died
+LOCK_SECS = 300
+# how often a worker waiting on another one's lock looks again
+LOCK_POLL_SECS = 0.5
+# the directory libgb lives in, for the worker's interpreter
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Analysis(NamedTuple):
+    # per rom bank, array("H") bytes of the offsets blocks start at, sorted
+    starts: List[bytes]
+    # per rom bank, the offset just past each block's straight-line code
+    ends: List[bytes]
+    # (bank, addr) of jumps into ram or to a bank that couldn't be worked out
+    unresolved: List[Tuple[int, int]]
+
+    def spans(self, bank: int) -> List[Tuple[int, int]]:
+        # (start, end) offsets of the blocks found in a bank
+        return list(zip(array("H", self.starts[bank]), array("H", self.ends[bank])))
+
+    def is_block(self, bank: int, addr: int) -> bool:
+        starts = array("H", self.starts[bank])
+        offset = addr & (BANK_SIZE - 1)
+        i = bisect_right(starts, offset)
+        return i > 0 and starts[i - 1] == offset
+
+
+def jump_target(op: int, addr: int, mem) -> Optional[int]:
+    offset = addr & (BANK_SIZE - 1)
+    if op == JR or op in COND_JRS:
+        rel = mem[offset + 1]
+        rel = rel - 0x100 if rel & 0x80 else rel
+        return (addr + 2 + rel) & 0xFFFF
+    if op in (JP, CALL) or op in COND_JPS or op in COND_CALLS:
+        return mem[offset + 1] | mem[offset + 2] << 8
+    if op in RSTS:
+        return op - RST_START
+    return None
+
+
+def analyze(rom: Rom) -> Analysis:
+    """recursive disassembly from the entry point, rst and interrupt vectors
+
+    `mapped` follows which bank sits at 0x4000 while running bank 0 code:
+    bank 1 from reset, unknown (None) in rst and interrupt handlers.
+    """
+    nbanks = len(rom.banks)
+    switchable = nbanks > 2
+    code = [bytearray(BANK_SIZE) for _ in range(nbanks)]
+    starts = [set() for _ in range(nbanks)]
+    unresolved = []
+    seen = set()
+
+    boot = 1 % nbanks
+    work = [(0, ENTRY, boot)]
+    work.extend((0, addr, None if switchable else boot) for addr in RST_VECTORS)
+    work.extend((0, addr, None if switchable else boot) for _, addr in INTERRUPT_VECTOR)
+
+    def resolve(target: int, bank: int, mapped: Optional[int]):
+        if target < BANK_SIZE:
+            return 0, mapped
+        if target < 2 * BANK_SIZE:
+            if bank != 0:
+                return bank, bank
+            if mapped is not None:
+                return mapped, mapped
+        return None, mapped
+
+    while work:
+        bank, addr, mapped = work.pop()
+        if bank != 0:
+            mapped = bank
+        mem = rom.banks[bank]
+        code[bank][addr & (BANK_SIZE - 1)] |= BLOCK
+        starts[bank].add(addr & (BANK_SIZE - 1))
+        known: Dict[str, int] = {}
+        while True:
+            if (bank, addr, mapped if bank == 0 else None) in seen:
+                break
+            seen.add((bank, addr, mapped if bank == 0 else None))
+            offset = addr & (BANK_SIZE - 1)
+            op = mem[offset]
+            size = OP_LENGTH[op]
+            if OP_TABLE[op] is unimplemented or offset + size > BANK_SIZE:
+                break
+            flags = code[bank]
+            flags[offset] |= INSTR
+            for i in range(1, size):
+                flags[offset + i] |= OPERAND
+
+            if op == LD_A_IMM:
+                known["A"] = mem[offset + 1]
+            elif op == LD_HL_IMM:
+                known["HL"] = mem[offset + 1] | mem[offset + 2] << 8
+            elif op not in KEEPS_A_HL:
+                known.clear()
+            select = None
+            if op == LD_IMM16_A and "A" in known:
+                select = mem[offset + 1] | mem[offset + 2] << 8, known["A"]
+            elif op == LD_HLp_A and "A" in known and "HL" in known:
+                select = known["HL"], known["A"]
+            elif op == LD_HLp_IMM and "HL" in known:
+                select = known["HL"], mem[offset + 1]
+            if switchable and bank == 0 and select is not None:
+                dst, val = select
+                if BANK_SELECT_LO <= dst <= BANK_SELECT_HI:
+                    mapped = max(val % nbanks, 1)
+
+            target = jump_target(op, addr, mem)
+            if target is not None:
+                target_bank, target_mapped = resolve(target, bank, mapped)
+                if target_bank is None:
+                    unresolved.append((bank, addr))
+                else:
+                    work.append((target_bank, target, target_mapped))
+            elif op == JP_HL:
+                unresolved.append((bank, addr))
+
+            if op in ENDS:
+                break
+            addr += size
+            if op in BRANCHES:
+                # whatever follows a branch starts a block of its own
+                work.append((bank, addr, mapped))
+                break
+            if addr == BANK_SIZE and bank == 0:
+                # ran off the end of bank 0 into whatever is mapped
+                if mapped is None:
+                    break
+                bank, mem = mapped, rom.banks[mapped]
+                code[bank][0] |= BLOCK
+                starts[bank].add(0)
+            elif addr == 2 * BANK_SIZE:
+                break
+
+    # only the block index is kept, the bitmaps are 16k a bank
+    ends = []
+    for bank, flags in enumerate(code):
+        mem = rom.banks[bank]
+        bank_starts, bank_ends = array("H"), array("H")
+        for start in sorted(starts[bank]):
+            offset = start
+            while offset < BANK_SIZE and flags[offset] & INSTR:
+                op = mem[offset]
+                offset += OP_LENGTH[op]
+                if op in ENDS or op in BRANCHES or (offset < BANK_SIZE and flags[offset] & BLOCK):
+                    break
+            if offset > start:
+                bank_starts.append(start)
+                bank_ends.append(offset)
+        starts[bank] = bank_starts.tobytes()
+        ends.append(bank_ends.tobytes())
+    return Analysis(starts, ends, unresolved)
+
+
+class Background:
+    """rom analysis in a worker process, cached per rom
+
+    the worker is a fresh interpreter started with the rom's file and the
+    cache root. it looks the rom up in the cache itself, so the emulator
+    never hashes the rom or reads the cache for it, and the result comes
+    back over its stdout. poll() drains that without blocking. the worker
+    finishes filling the cache even if the emulator is gone by then.
+    """
+    def __init__(self, rom: Rom, tcache: TranslationCache):
+        self.rom = rom
+        self.tcache = tcache
+        self.result = None
+        self.chunks: List[bytes] = []
+        # None once the worker is done, or when there's none
+        self.proc = start(rom, tcache)
+
+    @property
+    def pending(self) -> bool:
+        return self.proc is not None
+
+    def poll(self) -> Optional[Analysis]:
+        if self.proc is None:
+            return self.result
+        fd = self.proc.stdout.fileno()
+        try:
+            while True:
+                chunk = os.read(fd, 1 << 16)
+                if not chunk:
+                    break
+                self.chunks.append(chunk)
+        except BlockingIOError:
+            return None
+        self.proc.stdout.close()
+        self.proc.wait()
+        self.proc = None
+        data = b"".join(self.chunks)
+        self.chunks = []
+        if data:
+            try:
+                self.result = Analysis(*marshal.loads(data))
+            except (EOFError, ValueError, TypeError):
+                pass
+        return self.result
+
+
+# one worker per rom, shared by every instance running it (see VecGameboy)
+running: "WeakKeyDictionary[Rom, Background]" = WeakKeyDictionary()
+
+
+def background(rom: Rom, tcache: TranslationCache) -> Background:
+    job = running.get(rom)
+    if job is None:
+        job = running[rom] = Background(rom, tcache)
+    return job
+
+
+def start(rom: Rom, tcache: TranslationCache) -> Optional[subprocess.Popen]:
+    # only a persistent cache can keep the result for the next run, and
+    # the worker needs a file to read the rom from
+    if tcache.root is None or rom.file is None:
+        return None
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [ROOT, env.get("PYTHONPATH")]))
+    try:
+        proc = subprocess.Popen([sys.executable, "-m", "libgb.analysis", rom.file, tcache.root],
+                                stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, env=env)
+    except OSError:
+        return None
+    os.set_blocking(proc.stdout.fileno(), False)
+    return proc
+
+
+def work(rom: Rom, root: str, out) -> int:
+    worker = TranslationCache(rom, root)
+    lock = worker.path + ".lock"
+    entry = worker.get(KEY)
+    while entry is None:
+        if take_lock(lock):
+            try:
+                entry = tuple(analyze(rom))
+                worker.put(KEY, entry, SPANS)
+                worker.save()
+            finally:
+                os.unlink(lock)
+            break
+        # another process is on it; its result lands in the cache
+        time.sleep(LOCK_POLL_SECS)
+        worker.load()
+        entry = worker.get(KEY)
+    try:
+        out.write(marshal.dumps(entry))
+        out.flush()
+    except BrokenPipeError:
+        # the emulator quit first; the cache already has the result, and
+        # stdout is pointed at devnull so exiting doesn't flush into the pipe
+        os.dup2(os.open(os.devnull, os.O_WRONLY), out.fileno())
+    return 0
+
+
+def take_lock(lock: str) -> bool:
+    try:
+        os.makedirs(os.path.dirname(lock), exist_ok=True)
+        if os.path.exists(lock) and time.time() - os.path.getmtime(lock) > LOCK_SECS:
+            os.unlink(lock)
+        os.close(os.open(lock, os.O_CREAT | os.O_EXCL))
+    except OSError:
+        return False
+    return True
+
+
+if __name__ == "__main__":
+    # python -m libgb.analysis ROM CACHE_ROOT, run by Background. it only
+    # wants the cpu the emulator leaves over
+    if hasattr(os, "nice"):
+        os.nice(10)
+    sys.exit(work(Rom.from_file(sys.argv[1]), sys.argv[2], sys.stdout.buffer))
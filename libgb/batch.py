@@ -0,0 +1,111 @@
+from concurrent.futures import ProcessPoolExecutor
+import contextlib
+import hashlib
+import os
+import time
+from typing import List, NamedTuple, Optional
+
+from . import prof
+from .gameboy import CHECK_EVERY, Gameboy
+from .lcd import NullSink
+from .rom import Rom
+from .sched import NEVER
+from .testrom import SerialVerdict
+
+ROM_EXTS = (".gb", ".gbc")
+
+
+class Job(NamedTuple):
+    rom: str
+    cycles: Optional[int] = None
+    frames: Optional[int] = None
+
+
+def find_roms(path: str) -> List[str]:
+    roms = []
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        roms.extend(os.path.join(root, f) for f in sorted(files) if f.lower().endswith(ROM_EXTS))
+    return roms
+
+
+def read_manifest(path: str, cycles: int = None, frames: int = None) -> List[Job]:
+    # one rom per line, relative to the manifest, optionally followed by
+    # cycles=N and/or frames=N overriding the default budget
+    base = os.path.dirname(path)
+    jobs = []
+    with open(path) as f:
+        for lineno, line in enumerate(f, 1):
+            fields = line.split("#", 1)[0].split()
+            if not fields:
+                continue
+            budget = {"cycles": cycles, "frames": frames}
+            for field in fields[1:]:
+                key, _, val = field.partition("=")
+                if key not in budget or not val.isdigit():
+                    raise ValueError("{}:{}: bad manifest field {!r}".format(path, lineno, field))
+                budget[key] = int(val)
+            jobs.append(Job(os.path.join(base, fields[0]), **budget))
+    return jobs
+
+
+def make_jobs(path: str, cycles: int = None, frames: int = None) -> List[Job]:
+    if os.path.isdir(path):
+        return [Job(rom, cycles, frames) for rom in find_roms(path)]
+    return read_manifest(path, cycles, frames)
+
+
+def run_job(job: Job) -> dict:
+    result = {"rom": job.rom, "exit": "error", "serial": "", "frame_sha1": None,
+              "cycles": 0, "frames": 0, "host_secs": 0.0}
+    start = time.perf_counter()
+    gb = None
+    # pool workers are reused, and the profiler is module state
+    prof.init()
+    # debug prints from the core would only interleave between workers
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        try:
+            rom = Rom.from_file(job.rom)
+            # results shouldn't depend on .sav files left behind by earlier runs
+            rom.path = None
+            gb = Gameboy.from_rom(rom, NullSink(), "python")
+            result["exit"] = run_budget(gb, job, SerialVerdict(gb.serial))
+            # only the final frame is composed
+            gb.gpu.draw_display(gb.mmu)
+            result["frame_sha1"] = hashlib.sha1(gb.gpu.frame).hexdigest()
+            gb.tcache.save()
+        except Exception as e:
+            result["error"] = "{}: {}".format(type(e).__name__, e)
+    if gb is not None:
+        result["serial"] = gb.serial.output.decode("latin-1")
+        result["cycles"] = gb.sched.now
+        result["frames"] = gb.gpu.frames
+    result["host_secs"] = time.perf_counter() - start
+    return result
+
+
+def run_budget(gb: Gameboy, job: Job, verdict: SerialVerdict) -> str:
+    # test roms stop as soon as they report passed/failed
+    cycles = job.cycles or NEVER
+    frames = job.frames or NEVER
+    while verdict.result is None:
+        if gb.sched.now >= cycles:
+            return "cycles"
+        if gb.gpu.frames >= frames:
+            return "frames"
+        if gb.run_to(min(gb.sched.now + CHECK_EVERY, cycles), frames):
+            return verdict.result or "stopped"
+    return verdict.result
+
+
+def run_batch(jobs: List[Job], workers: int = None) -> dict:
+    start = time.perf_counter()
+    # one rom per task so long roms don't hold up a whole chunk
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        results = list(pool.map(run_job, jobs))
+    return {
+        "workers": workers or os.cpu_count(),
+        "roms": len(results),
+        "host_secs": time.perf_counter() - start,
+        "results": results,
+    }
@@ -1,24 +1,19 @@
-from os import stat
-from .rom import Rom
-from .memory import RomBank, FixedWorkRam, MemoryRegion
+import mmap
+import os
+from .rom import CartridgeType, Rom
+from .memory import ExternalRam, RomBank, MemoryRegion
+from .rtc import NUM_REGS, RTC_SIZE, Rtc
 
 # 0xA in lower 4 bits turns on, else off
 RAM_ENABLE_LO = 0
 RAM_ENABLE_HI = 0x1FFF
-# in MBC 1, 00 translates to 01
 ROM_BANK_NUM_LO = 0x2000
 ROM_BANK_NUM_HI = 0x3FFF
 # RAM_BANK_NUM region can select upper bits of ROM depending on mode
 # only first (lowest?) two bits used
 RAM_BANK_NUM_LO = 0x4000
 RAM_BANK_NUM_HI = 0x5FFF
-
-RAM_ROM_MODE_LO = 0x6000
-RAM_ROM_MODE_HI = 0x7FFF
-
-LATCH_CLK_DATA_LO = 0x6000
-LATCH_CLK_DATA_HI = 0x7FFF
-
+RAM_BANK_MAX = 0x07
 
 ROM_FIXED_LO = 0x0000
 ROM_FIXED_HI = 0x3FFF
@@ -28,62 +23,329 @@ ROM_BANKED_HI = 0x7FFF
 EXTERNAL_RAM_LO = 0xA000
 EXTERNAL_RAM_HI = 0xBFFF
 
-class Cart(MemoryRegion):
+SAVE_EXT = ".sav"
+
+
+class CartError(Exception):
     pass
 
-class MBC3(Cart):
-    name="MBC3"
 
-    def __init__(self, fixed_rom: RomBank, banked_rom: RomBank, ram: FixedWorkRam):
+def save_path(rom: Rom) -> str:
+    return os.path.splitext(rom.path)[0] + SAVE_EXT
+
+
+def map_save(path: str, size: int) -> mmap.mmap:
+    # writes go straight to the page cache, so there is no explicit save step
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if os.fstat(fd).st_size < size:
+            os.ftruncate(fd, size)
+        return mmap.mmap(fd, size)
+    finally:
+        os.close(fd)
+
+
+def open_ram(rom: Rom, size: int = None):
+    if size is None:
+        size = rom.header.ram_size()
+    if rom.path is not None and rom.header.has_battery() and size > 0:
+        path = save_path(rom)
+        try:
+            return map_save(path, size)
+        except OSError as e:
+            # e.g. a read-only rom directory; the game still runs, unsaved
+            print("! couldn't map {}, cart ram won't be saved: {}".format(path, e))
+    return bytearray(size)
+
+
+class Cart(MemoryRegion):
+    """rom-only cart; MBCs override write_reg/update_windows
+
+    register writes precompute the rom/ram windows, so reads never have
+    to look at banking registers.
+    """
+    name = "ROM"
+    # registers saved in save states
+    REGS = ["ram_enable"]
+    rtc = None
+    # the mapped .sav behind the ram, if there is one
+    sav = None
+
+    def __init__(self, fixed_rom: RomBank, banked_rom: RomBank, ram: ExternalRam):
         self.fixed_rom = fixed_rom
         self.banked_rom = banked_rom
         self.ram = ram
-        self.ram_rtc_enable = False
-        self.rom_bank = 1
-        self.ram_bank = 0
-        self.clock_latch = 0
+        self.ram_enable = True
 
     def __contains__(self, addr: int) -> bool:
-        return addr in self.fixed_rom or addr in self.banked_rom or addr in self.ram
+        return addr <= ROM_BANKED_HI or EXTERNAL_RAM_LO <= addr <= EXTERNAL_RAM_HI
+
+    @classmethod
+    def from_rom(cls, rom: Rom, ram_size: int = None) -> "Cart":
+        data = open_ram(rom, ram_size)
+        cart = cls.with_ram(rom, data)
+        cart.keep_sav(data)
+        return cart
+
+    def keep_sav(self, data):
+        if isinstance(data, mmap.mmap):
+            self.sav = data
 
-    @staticmethod
-    def from_rom(rom: Rom) -> "MBC3":
-        fixed_rom = RomBank(ROM_FIXED_LO, ROM_FIXED_HI, rom.data)
-        banked_rom = RomBank(ROM_BANKED_LO, ROM_BANKED_HI, rom.data)
-        ram = FixedWorkRam(EXTERNAL_RAM_LO, EXTERNAL_RAM_HI)
+    def flush(self):
+        # the clock block is otherwise only written on latches and register
+        # writes, so bring it up to date before the .sav goes to disk
+        if self.rtc is not None:
+            self.rtc.sync()
+        if self.sav is not None:
+            self.sav.flush()
 
-        return MBC3(fixed_rom, banked_rom, ram)
+    @classmethod
+    def with_ram(cls, rom: Rom, data) -> "Cart":
+        fixed_rom = RomBank(ROM_FIXED_LO, ROM_FIXED_HI, rom.banks)
+        banked_rom = RomBank(ROM_BANKED_LO, ROM_BANKED_HI, rom.banks, bank=1)
+        ram = ExternalRam(EXTERNAL_RAM_LO, EXTERNAL_RAM_HI, data)
+
+        cart = cls(fixed_rom, banked_rom, ram)
+        cart.update_windows()
+        return cart
 
     def load(self, addr: int) -> int:
+        if addr < ROM_BANKED_LO:
+            return self.fixed_rom.mem[addr]
+        if addr <= ROM_BANKED_HI:
+            return self.banked_rom.mem[addr - ROM_BANKED_LO]
+        if self.ram_enable:
+            return self.ram.load(addr)
+        return 0xff
+
+    def view(self, addr: int, size: int):
         if addr in self.fixed_rom:
-            return self.fixed_rom.load(addr)
+            return self.fixed_rom.view(addr, size)
         if addr in self.banked_rom:
-            return self.banked_rom.load(addr, bank=self.rom_bank)
-        if addr in self.ram:
-            if self.ram_rtc_enable:
-                return self.ram.load(addr)
-            else:
-                return 0xff
-        assert False, "bad addr"
+            return self.banked_rom.view(addr, size)
+        return None
 
     def store(self, addr: int, val: int):
-        if addr in self.ram:
+        if addr <= ROM_BANKED_HI:
+            self.write_reg(addr, val)
+        elif self.ram_enable:
             self.ram.store(addr, val)
-        elif RAM_ENABLE_LO <= addr <= RAM_ENABLE_HI:
-            self.ram_rtc_enable = (val & 0xa) == 0xa
-        elif ROM_BANK_NUM_LO <= addr <= ROM_BANK_NUM_HI:
-            if val == 0:
-                val = 1
-            self.rom_bank = val
-        elif RAM_BANK_NUM_LO <= addr <= RAM_BANK_NUM_HI:
+
+    def write_reg(self, addr: int, val: int):
+        pass
+
+    def update_windows(self):
+        pass
+
+    def attach(self, clock, wall_clock: bool = False):
+        # carts with a clock read time from here
+        pass
+
+
+class MBC1(Cart):
+    name = "MBC1"
+    REGS = ["ram_enable", "bank1", "bank2", "mode"]
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.ram_enable = False
+        self.bank1 = 1
+        self.bank2 = 0
+        self.mode = 0
+
+    def write_reg(self, addr: int, val: int):
+        if addr <= RAM_ENABLE_HI:
+            self.ram_enable = (val & 0xf) == 0xa
+            return
+        if addr <= ROM_BANK_NUM_HI:
+            # in MBC 1, 00 translates to 01
+            self.bank1 = (val & 0x1f) or 1
+        elif addr <= RAM_BANK_NUM_HI:
+            self.bank2 = val & 0x3
+        else:
+            self.mode = val & 0x1
+        self.update_windows()
+
+    def update_windows(self):
+        # bank2 is the upper rom bits, and in mode 1 also banks 0000-3FFF and ram
+        upper = self.bank2 << 5
+        self.banked_rom.select(upper | self.bank1)
+        if self.mode:
+            self.fixed_rom.select(upper)
+            self.ram.select(self.bank2)
+        else:
+            self.fixed_rom.select(0)
+            self.ram.select(0)
+
+
+MBC2_RAM_SIZE = 0x200
+# register select bit for writes to 0000-3FFF
+MBC2_ROM_SELECT = 1 << 8
+
+class MBC2(Cart):
+    name = "MBC2"
+    REGS = ["ram_enable", "rom_bank"]
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.ram_enable = False
+        self.rom_bank = 1
+
+    def load(self, addr: int) -> int:
+        if addr < EXTERNAL_RAM_LO:
+            return super().load(addr)
+        # 512 half-byte cells, mirrored across the window
+        if self.ram_enable:
+            return self.ram.load(addr) | 0xf0
+        return 0xff
+
+    def store(self, addr: int, val: int):
+        super().store(addr, val & 0xf if addr >= EXTERNAL_RAM_LO else val)
+
+    def write_reg(self, addr: int, val: int):
+        if addr > ROM_BANK_NUM_HI:
+            return
+        if addr & MBC2_ROM_SELECT:
+            self.rom_bank = (val & 0xf) or 1
+            self.update_windows()
+        else:
+            self.ram_enable = (val & 0xf) == 0xa
+
+    def update_windows(self):
+        self.banked_rom.select(self.rom_bank)
+
+
+RTC_BANK_LO = 0x08
+
+class MBC3(Cart):
+    name = "MBC3"
+    REGS = ["ram_enable", "rom_bank", "ram_bank", "clock_latch"]
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.ram_enable = False
+        self.rom_bank = 1
+        self.ram_bank = 0
+        self.clock_latch = 0
+
+    @classmethod
+    def from_rom(cls, rom: Rom, ram_size: int = None) -> "Cart":
+        if not rom.header.has_timer():
+            return super().from_rom(rom, ram_size)
+        if ram_size is None:
+            ram_size = rom.header.ram_size()
+        # the clock is kept after the ram, in the same .sav
+        sav = open_ram(rom, ram_size + RTC_SIZE)
+        data = memoryview(sav)
+        cart = cls.with_ram(rom, data[:ram_size])
+        cart.rtc = Rtc(data[ram_size:])
+        cart.keep_sav(sav)
+        return cart
+
+    def attach(self, clock, wall_clock: bool = False):
+        if self.rtc is not None:
+            self.rtc.attach(clock, wall_clock)
+
+    def rtc_reg(self) -> int:
+        # index of the selected clock register, or -1 when none is usable
+        idx = self.ram_bank - RTC_BANK_LO
+        if self.rtc is None or not self.ram_enable or not 0 <= idx < NUM_REGS:
+            return -1
+        return idx
+
+    def load(self, addr: int) -> int:
+        if addr >= EXTERNAL_RAM_LO and self.ram_bank > RAM_BANK_MAX:
+            idx = self.rtc_reg()
+            return self.rtc.load(idx) if idx >= 0 else 0xff
+        return super().load(addr)
+
+    def store(self, addr: int, val: int):
+        if addr >= EXTERNAL_RAM_LO and self.ram_bank > RAM_BANK_MAX:
+            idx = self.rtc_reg()
+            if idx >= 0:
+                self.rtc.store(idx, val)
+            return
+        super().store(addr, val)
+
+    def write_reg(self, addr: int, val: int):
+        if addr <= RAM_ENABLE_HI:
+            self.ram_enable = (val & 0xf) == 0xa
+        elif addr <= ROM_BANK_NUM_HI:
+            self.rom_bank = (val & 0x7f) or 1
+            self.update_windows()
+        elif addr <= RAM_BANK_NUM_HI:
             self.ram_bank = val
-        elif LATCH_CLK_DATA_LO <= addr <= LATCH_CLK_DATA_HI:
-            if self.clock_latch == 0 and val == 1:
-                # update clock registers
-                pass
+            self.update_windows()
+        else:
+            if self.clock_latch == 0 and val == 1 and self.rtc is not None:
+                self.rtc.latch()
             self.clock_latch = val
 
+    def update_windows(self):
+        self.banked_rom.select(self.rom_bank)
+        if self.ram_bank <= RAM_BANK_MAX:
+            self.ram.select(self.ram_bank)
+
+
+MBC5_ROM_BANK_HI = 0x3000
+
+class MBC5(Cart):
+    name = "MBC5"
+    REGS = ["ram_enable", "rom_bank", "ram_bank"]
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.ram_enable = False
+        self.rom_bank = 1
+        self.ram_bank = 0
+
+    def write_reg(self, addr: int, val: int):
+        if addr <= RAM_ENABLE_HI:
+            self.ram_enable = (val & 0xf) == 0xa
+            return
+        if addr < MBC5_ROM_BANK_HI:
+            # 9 bit rom bank, bank 0 is selectable
+            self.rom_bank = (self.rom_bank & 0x100) | val
+        elif addr <= ROM_BANK_NUM_HI:
+            self.rom_bank = (self.rom_bank & 0xff) | ((val & 0x1) << 8)
+        elif addr <= RAM_BANK_NUM_HI:
+            self.ram_bank = val & 0xf
+        self.update_windows()
+
+    def update_windows(self):
+        self.banked_rom.select(self.rom_bank)
+        self.ram.select(self.ram_bank)
+
+
+CART_TYPES = {
+    CartridgeType.ROM_ONLY: Cart,
+    CartridgeType.ROM_RAM: Cart,
+    CartridgeType.ROM_RAM_BATTERY: Cart,
+    CartridgeType.MBC1: MBC1,
+    CartridgeType.MBC1_RAM: MBC1,
+    CartridgeType.MBC1_RAM_BATTERY: MBC1,
+    CartridgeType.HuC1_RAM_BATTERY: MBC1,
+    CartridgeType.MBC2: MBC2,
+    CartridgeType.MBC2_BATTERY: MBC2,
+    CartridgeType.MBC3_TIMER_BATTERY: MBC3,
+    CartridgeType.MBC3_TIMER_RAM_BATTERY: MBC3,
+    CartridgeType.MBC3: MBC3,
+    CartridgeType.MBC3_RAM: MBC3,
+    CartridgeType.MBC3_RAM_BATTERY: MBC3,
+    CartridgeType.MBC5: MBC5,
+    CartridgeType.MBC5_RAM: MBC5,
+    CartridgeType.MBC5_RAM_BATTERY: MBC5,
+    CartridgeType.MBC5_RUMBLE: MBC5,
+    CartridgeType.MBC5_RUMBLE_RAM: MBC5,
+    CartridgeType.MBC5_RUMBLE_RAM_BATTERY: MBC5,
+}
+
 
 def from_rom(rom: Rom) -> Cart:
-    # assume mbc3 :)
-    pass
+    cart_type = rom.header.cart_type
+    if cart_type not in CART_TYPES:
+        raise CartError("unsupported cartridge type {}".format(cart_type.name))
+    cls = CART_TYPES[cart_type]
+    if cls is MBC2:
+        return cls.from_rom(rom, ram_size=MBC2_RAM_SIZE)
+    return cls.from_rom(rom)
@@ -5,6 +5,7 @@ from . import instr, prof, reg
 from .mmu import MMU
 from .reg import Regs
 from .io import InterruptIO, IOHandler
+from .sched import Scheduler
 
 
 CPU_CLOCK = 4194304
@@ -31,25 +32,42 @@ INTERRUPT_VECTOR = [
     (SERIAL_INT, 0x58),
     (JOYPAD_INT, 0x60),
 ]
+ALL_INTS = 0x1F
+
+# pending mask -> (interrupt, vector) of the highest priority one
+DISPATCH = [None] * (ALL_INTS + 1)
+for mask in range(1, ALL_INTS + 1):
+    DISPATCH[mask] = next((i, t) for i, t in INTERRUPT_VECTOR if mask & i)
+
+# EI's own 4 ticks, then one into the next instruction
+EI_DELAY = 5
 
 
 class CPU:
-    if_vector: int
-    ie_vector: int
     def __init__(self, max_execs=None):
         self.execs = 0
         self.cycles = 0
         self.max_execs = max_execs
         self.execed = []
+        # profiling, tracing, breakpoints and printing; Gameboy.run turns
+        # it on, the library run_* calls leave it off
+        self.debug = False
         self.bps = []
         self.single_step = False
         self.trace = deque(maxlen=20)
         self.branch = deque(maxlen=20)
 
-        self.if_vector = 0
-        self.ie_vector = 0
+        self._if = 0
+        self._ie = 0
+        # IME and an enabled interrupt requested, kept up to date by whatever
+        # changes IF, IE or IME so step only has to look here
+        self.pending = False
+        self.sched = None
+        # decode.DecodeCache for rom code, if there is one
+        self.decoded = None
 
         self.regs = Regs()
+        self.regs.listener = self
         self.regs.store(reg.AF, 0x01B0)
         self.regs.store(reg.BC, 0x0013)
         self.regs.store(reg.DE, 0x00D8)
@@ -58,20 +76,57 @@ class CPU:
         self.regs.store(reg.PC, 0x0100)
 
 
+    @property
+    def if_vector(self) -> int:
+        return self._if
+
+    @if_vector.setter
+    def if_vector(self, val: int):
+        self._if = val
+        self.update_pending()
+
+    @property
+    def ie_vector(self) -> int:
+        return self._ie
+
+    @ie_vector.setter
+    def ie_vector(self, val: int):
+        self._ie = val
+        self.update_pending()
+
+    def attach(self, sched: Scheduler):
+        # EI's delay runs on the scheduler; without one EI is immediate
+        self.sched = sched
+        sched.register("ei", self.ei_due)
+
+    def update_pending(self):
+        self.pending = self.regs.IME and (self._ie & self._if & ALL_INTS) != 0
+
+    def ime_changed(self):
+        if not self.regs.IME and self.sched is not None:
+            # DI right after EI keeps interrupts off
+            self.sched.cancel("ei")
+        self.update_pending()
+
+    def ei(self):
+        if self.sched is None:
+            self.regs.IME = True
+        else:
+            self.sched.schedule("ei", EI_DELAY)
+
+    def ei_due(self):
+        self.regs.IME = True
+
+
     def request_interrupt(self, i: Interrupt):
-        self.if_vector |= i.value
+        self.if_vector = self._if | i.value
         self.regs.halted = False
 
 
     def service_interrupts(self, mmu: MMU):
-        if self.ie_vector & self.if_vector == 0:
-            return
-        triggered_interrupts = self.ie_vector & self.if_vector
-        for interrupt, target in INTERRUPT_VECTOR:
-            if interrupt & triggered_interrupts != 0:
-                self.if_vector &= ~interrupt
-                instr.interrupt(self.regs, mmu, target)
-                return
+        interrupt, target = DISPATCH[self._ie & self._if & ALL_INTS]
+        self.if_vector = self._if & ~interrupt
+        instr.interrupt(self.regs, mmu, target)
 
 
     def show_trace(self):
@@ -80,18 +135,38 @@ class CPU:
 
 
     def step(self, mmu: MMU, show=False) -> bool:
-        if self.regs.IME:
+        if self.pending:
             self.service_interrupts(mmu)
 
         if self.regs.halted:
             return False
 
         pc = self.regs.load(reg.PC)
-        op = mmu.load(pc)
-        inst = instr.exec_instr(op, self.regs, mmu)
+        entry = self.decoded.fetch(mmu, pc) if self.decoded is not None else None
+        if entry is not None:
+            op = entry.op
+            inst = instr.exec_decoded(entry, self.regs, mmu)
+        else:
+            op = mmu.load(pc)
+            inst = instr.exec_instr(op, self.regs, mmu)
         next_pc = self.regs.load(reg.PC) + inst.step
         self.regs.store(reg.PC, next_pc)
 
+        if self.debug or show:
+            self.debug_step(op, pc, next_pc, inst, show)
+
+        self.cycles += inst.cycles
+        self.execs += 1
+
+        done = bool(self.max_execs) and self.execs > self.max_execs
+        done |= inst.cycles == -1
+
+        if done and self.debug:
+            print(inst.mnem)
+
+        return done
+
+    def debug_step(self, op: int, pc: int, next_pc: int, inst, show=False):
         # profile
         prof.update(op, pc, next_pc, inst)
 
@@ -110,17 +185,6 @@ class CPU:
             if input() == "c":
                 self.single_step = False
 
-        self.cycles += inst.cycles
-        self.execs += 1
-
-        done = self.max_execs and self.execs > self.max_execs
-        done |= inst.cycles == -1
-
-        if done:
-            print(inst.mnem)
-
-        return done
-
 
 class InterruptIOHandler(IOHandler):
     def __init__(self, cpu: CPU):
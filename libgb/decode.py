@@ -0,0 +1,157 @@
+from typing import Callable, Iterable, List, NamedTuple, Optional, Tuple
+
+from .analysis import Analysis, Background
+from .gpu import LY_CLKS, LY_END
+from .instr import CB_PREFIX, CB_TABLE, OP_LENGTH, OP_TABLE
+from .memory import PAGE_BITS, FixedWorkRam
+from .mmu import MMU
+from .rom import BANK_SIZE, Rom
+from .sched import Scheduler
+
+ROM_END = 2 * BANK_SIZE
+# ram pages whose code has been overwritten this often are left to the mmu
+SMC_LIMIT = 32
+# the background analysis is looked for once a frame until it's in
+POLL_TICKS = LY_CLKS * (LY_END + 1)
+
+
+class Decoded(NamedTuple):
+    op: int
+    # takes an ops.Ctx carrying imm, returns an instr.Instr
+    handler: Callable
+    imm: Optional[int]
+    length: int
+
+
+def decode(mem, offset: int) -> Optional[Decoded]:
+    op = mem[offset]
+    length = OP_LENGTH[op]
+    if offset + length > len(mem):
+        # runs off the end of the bank, left to the mmu
+        return None
+    handler = OP_TABLE[op]
+    imm = None
+    if op == CB_PREFIX:
+        handler = CB_TABLE[mem[offset + 1]]
+    elif length == 2:
+        imm = mem[offset + 1]
+    elif length == 3:
+        imm = mem[offset + 1] | mem[offset + 2] << 8
+    return Decoded(op, handler, imm, length)
+
+
+class RamCode:
+    """decoded instructions in one ram region, indexed by offset
+
+    an entry keeps the write generation its page had and the bytes it was
+    decoded from. once the page has been written to, the bytes are
+    compared again and the entry is only thrown away if they changed.
+    """
+    def __init__(self, region: FixedWorkRam):
+        self.region = region
+        self.entries: List[Optional[Tuple[Decoded, int, bytes]]] = [None] * region.size
+        # per page, entries thrown away because their code was rewritten
+        self.invalidations = [0] * len(region.pages)
+
+    def __contains__(self, addr: int) -> bool:
+        return addr in self.region
+
+    def fetch(self, pc: int) -> Optional[Decoded]:
+        region = self.region
+        offset = pc - region.lower
+        page = offset >> PAGE_BITS
+        generation = region.pages[page]
+        slot = self.entries[offset]
+        if slot is not None:
+            entry, seen, raw = slot
+            if seen == generation:
+                return entry
+            if region.mem[offset:offset + len(raw)] == raw:
+                self.entries[offset] = (entry, generation, raw)
+                return entry
+            self.entries[offset] = None
+            self.invalidations[page] += 1
+        if self.invalidations[page] >= SMC_LIMIT:
+            # rewritten all the time, not worth decoding
+            return None
+        entry = decode(region.mem, offset)
+        if entry is None or (offset + entry.length - 1) >> PAGE_BITS != page:
+            # only one page's generation is checked
+            return None
+        self.entries[offset] = (entry, generation, bytes(region.mem[offset:offset + entry.length]))
+        return entry
+
+
+class DecodeCache:
+    """decoded instructions, one table per rom bank indexed by offset
+
+    rom never changes, so an address is decoded the first time it runs and
+    never fetched again. code run from the ram regions given is cached too,
+    see RamCode. once the background analysis is in (polled from a
+    scheduler event), the blocks it found are decoded ahead of time, a
+    bank at a time.
+    """
+    def __init__(self, rom: Rom, rams: Iterable[FixedWorkRam] = (),
+                 analysis: Optional[Background] = None, sched: Optional[Scheduler] = None):
+        self.rom = rom
+        self.tables: List[Optional[list]] = [None] * len(rom.banks)
+        self.rams = [RamCode(region) for region in rams]
+        self.analysis = analysis
+        self.blocks: Optional[Analysis] = None
+        self.sched = sched
+        if analysis is not None and sched is not None:
+            # a host event: polling has no effect on emulation, so it stays
+            # out of save states
+            sched.register("analysis", self.poll_due, host=True)
+            sched.schedule("analysis", POLL_TICKS)
+
+    def hotspots(self) -> List[Tuple[int, int]]:
+        # (page address, invalidations) of ram pages whose code was rewritten
+        return [(ram.region.lower + (page << PAGE_BITS), count)
+                for ram in self.rams for page, count in enumerate(ram.invalidations) if count]
+
+    def table(self, bank: int) -> list:
+        table = self.tables[bank]
+        if table is None:
+            table = self.tables[bank] = [None] * BANK_SIZE
+            if self.blocks is not None:
+                self.prefetch(bank, table)
+        return table
+
+    def poll_due(self):
+        self.blocks = self.analysis.poll()
+        if self.blocks is None:
+            if self.analysis.pending:
+                self.sched.schedule("analysis", POLL_TICKS)
+            return
+        for bank, table in enumerate(self.tables):
+            if table is not None:
+                self.prefetch(bank, table)
+
+    def prefetch(self, bank: int, table: list):
+        mem = self.rom.banks[bank]
+        for start, end in self.blocks.spans(bank):
+            offset = start
+            while offset < end:
+                entry = table[offset]
+                if entry is None:
+                    entry = table[offset] = decode(mem, offset)
+                    if entry is None:
+                        break
+                offset += entry.length
+
+    def fetch(self, mmu: MMU, pc: int) -> Optional[Decoded]:
+        # None when the caller should fetch through the mmu
+        if pc >= ROM_END:
+            for ram in self.rams:
+                if pc in ram:
+                    return ram.fetch(pc)
+            return None
+        cart = mmu.cart
+        region = cart.fixed_rom if pc < BANK_SIZE else cart.banked_rom
+        table = self.tables[region.bank] or self.table(region.bank)
+        offset = pc & (BANK_SIZE - 1)
+        entry = table[offset]
+        if entry is None:
+            entry = table[offset] = decode(region.mem, offset)
+        return entry
@@ -1,33 +1,93 @@
 import time
 from typing import NamedTuple
 
+from . import analysis
 from . import cpu
+from . import decode
 from . import gpu
 from . import joypad
+from . import lcd
 from . import mmu
 from . import rom
+from . import sched
 from . import serial
+from . import state
+from . import tcache
 from . import timer
 from . import prof
 
+# how often run_until checks its predicate, in ticks
+CHECK_EVERY = 4096
+
 class Gameboy(NamedTuple):
     cpu: cpu.CPU
     gpu: gpu.GPU
     mmu: mmu.MMU
     timer: timer.Timer
+    sched: sched.Scheduler
+    rom: rom.Rom
+    joypad: joypad.JoypadIOHandler
+    serial: serial.SerialIOHandler
+    tcache: tcache.TranslationCache
+    analysis: analysis.Background
+
+    def step(self) -> bool:
+        done = False
+        if self.sched.now >= self.cpu.cycles:
+            done |= self.cpu.step(self.mmu)
+        done |= self.gpu.step(self.cpu, self.mmu)
+        self.timer.step(self.cpu)
+        self.sched.tick()
+        return done
+
+    def run_cycles(self, n: int) -> bool:
+        # these return True when the emulator asked to stop, like step
+        return self.run_to(self.sched.now + n)
+
+    def run_frames(self, n: int) -> bool:
+        return self.run_to(sched.NEVER, self.gpu.frames + n)
+
+    def run_until(self, predicate, check_every: int = CHECK_EVERY) -> bool:
+        # True once predicate(gameboy) holds, False if the emulator stopped first
+        while not predicate(self):
+            if self.run_cycles(check_every):
+                return bool(predicate(self))
+        return True
+
+    def run_to(self, limit, frames=sched.NEVER) -> bool:
+        # same as calling step until sched.now reaches limit or gpu.frames
+        # reaches frames: the cpu runs an instruction, then everything else
+        # catches up with it in one go
+        c, g, m, t, s = self.cpu, self.gpu, self.mmu, self.timer, self.sched
+        done = False
+        while not done and s.now < limit and g.frames < frames:
+            if s.now >= c.cycles:
+                done = c.step(m)
+            if c.regs.halted:
+                # nothing can wake it before the next line, timer count or event
+                ticks = min(g.next_ly, t.until_tima(), s.next_event - s.now, limit - s.now)
+            else:
+                ticks = min(c.cycles - s.now, limit - s.now)
+            ticks = max(ticks, 1)
+            done |= g.advance(c, m, ticks)
+            t.advance(c, ticks)
+            s.advance(ticks)
+        return done
+
+    def save_state(self) -> bytes:
+        return state.save(self)
+
+    def load_state(self, data: bytes):
+        state.load(self, data)
 
     def run(self):
         done = False
         start = time.time()
-        ticks = 0
         prof.init()
+        self.cpu.debug = True
         while not done:
             try:
-                if ticks >= self.cpu.cycles:
-                    done |= self.cpu.step(self.mmu)
-                done |= self.gpu.step(self.cpu, self.mmu)
-                self.timer.step(self.cpu)
-                ticks += 1
+                done |= self.run_to(sched.NEVER)
             except:
                 done = True
                 print("-- branch history --")
@@ -40,21 +100,43 @@ class Gameboy(NamedTuple):
         print("-- REGS --")
         print(self.cpu.regs)
         print("num execs: {}".format(self.cpu.execs))
+        ticks = self.sched.now
         print("ticks: {}".format(ticks))
+        print("frames skipped: {}".format(self.gpu.frames_skipped))
         print("cpu secs: {}".format(ticks / cpu.CPU_CLOCK))
         print("wall secs: {}".format(end - start))
+        for addr, count in self.cpu.decoded.hotspots():
+            print("code rewritten in page ${:04X}: {} times".format(addr, count))
+        self.tcache.save()
+        self.mmu.cart.flush()
 
     @staticmethod
-    def from_rom(rom: rom.Rom):
+    def from_rom(rom: rom.Rom, sink: lcd.Sink = None, renderer: str = "auto",
+                 wall_clock: bool = False, inputs: joypad.InputSource = None,
+                 poll_ticks: int = joypad.FRAME_TICKS, cache: bool = True):
+        if sink is None:
+            sink = lcd.LCD()
         c = cpu.CPU()
-        g = gpu.GPU()
+        g = gpu.make_gpu(sink, renderer)
         m = mmu.MMU.from_rom(rom)
         t = timer.Timer()
+        s = sched.Scheduler()
+        c.attach(s)
+        # work left by earlier runs of the same rom
+        tc = tcache.TranslationCache.open(rom) if cache else tcache.TranslationCache(rom)
+        # code and block boundaries, worked out off the emulation thread
+        a = analysis.background(rom, tc)
+        c.decoded = decode.DecodeCache(rom, [m.wram, m.hram], a, s)
+        g.attach(m)
+        # the cart clock follows emulated time unless asked for the host's
+        m.cart.attach(time.time if wall_clock else lambda: s.now / cpu.CPU_CLOCK, wall_clock)
 
-        display_io_handler = gpu.DisplayIOHandler(g, m)
+        display_io_handler = gpu.DisplayIOHandler(g, m, s)
         interrupt_io_handler = cpu.InterruptIOHandler(c)
-        joypad_io_handler = joypad.JoypadIOHandler()
-        serial_io_handler = serial.SerialIOHandler()
+        if inputs is None:
+            inputs = sink.inputs()
+        joypad_io_handler = joypad.JoypadIOHandler(g, c, s, inputs, poll_ticks)
+        serial_io_handler = serial.SerialIOHandler(c, s)
         timer_io_handler = timer.TimerIOHandler(t)
         m.io_ports.register_handler(display_io_handler)
         m.io_ports.register_handler(interrupt_io_handler)
@@ -63,4 +145,4 @@ class Gameboy(NamedTuple):
         # m.io_ports.register_handler(sound_io_handler)
         m.io_ports.register_handler(timer_io_handler)
 
-        return Gameboy(c, g, m, t)
+        return Gameboy(c, g, m, t, s, rom, joypad_io_handler, serial_io_handler, tc, a)
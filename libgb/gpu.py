@@ -3,8 +3,9 @@ from typing import Dict, List
 
 from .cpu import CPU, Interrupt
 from .io import IOHandler, DisplayIO
-from .lcd import LCD
+from .lcd import FRAME_SIZE, HEIGHT, WIDTH, Sink
 from .mmu import MMU
+from .sched import Scheduler
 
 BLOCK_0 = 0x8000, 0x87FF
 BLOCK_1 = 0x8800, 0x8FFF
@@ -17,6 +18,15 @@ DISPLAY_MASK = {
     DisplayIO.STAT: 0b01111000,
     DisplayIO.LY: 0x00,
 }
+# registers whose writes can change a frame (scroll is tracked per line)
+DAMAGE_REGS = [
+    DisplayIO.LCDC,
+    DisplayIO.BGP,
+    DisplayIO.OBP0,
+    DisplayIO.OBP1,
+    DisplayIO.WY,
+    DisplayIO.WX,
+]
 
 
 class LCDC(IntFlag):
@@ -66,13 +76,27 @@ def load_sprite(sprite_bs: bytes):
     return x, y, tile_idx, flags
 
 
+def tile_variants(tile_bs: bytes):
+    # rows of a tile pre-flipped in [none, x, y, xy] order
+    tile = [bytes(row) for row in load_tile(tile_bs)]
+    x_flipped = [row[::-1] for row in tile]
+    return [tile, x_flipped, tile[::-1], x_flipped[::-1]]
+
+
+OBJ_TILES = 0x8000, 0x8FFF
+OBJ_PER_LINE = 10
+X_FLIP = 1 << 5
+Y_FLIP = 1 << 6
+OBJ_PALETTE = 1 << 4
+
+
 LY_CLKS = 456
 VBLANK_START = 144
 LY_END = 153
 
 class GPU:
     regs: Dict[DisplayIO, int]
-    def __init__(self):
+    def __init__(self, lcd: Sink):
         self.regs = {
             DisplayIO.LCDC: 0,
             DisplayIO.STAT: 0,
@@ -88,79 +112,149 @@ class GPU:
         }
         self.scs = [(0,0) for _ in range(144)]
         self.next_ly = LY_CLKS
-        self.lcd = LCD()
+        self.frames = 0
+        self.frame = bytearray(FRAME_SIZE)
+        self.lcd = lcd
+
+        # damage tracking
+        self.generation = 0
+        self.drawn = None
+        self.drawn_scs = None
+        self.frames_skipped = 0
+
+        # sprites
+        self.obj_variants = {}
+        self.obj_lines = [[] for _ in range(HEIGHT)]
+        self.obj_key = None
+
+    def attach(self, mmu: MMU):
+        mmu.vram.observers.append(self.vram_written)
+
+    def invalidate(self, mmu: MMU):
+        # drops everything derived from memory, e.g. after loading a state
+        self.drawn = None
+        self.obj_key = None
+        self.obj_variants.clear()
+
+    def vram_written(self, addr: int, val: int):
+        if addr <= OBJ_TILES[1]:
+            self.obj_variants.pop((addr - OBJ_TILES[0]) >> 4, None)
+
+    def get_variants(self, mmu: MMU, idx: int):
+        variants = self.obj_variants.get(idx)
+        if variants is None:
+            lo = mmu.vram.translate(OBJ_TILES[0]) + idx * 16
+            variants = tile_variants(mmu.vram.mem[lo:lo + 16])
+            self.obj_variants[idx] = variants
+        return variants
+
+    def sprite_lines(self, mmu: MMU, size_select: bool):
+        # per-line sprite lists, in drawing order, rebuilt only when OAM changes
+        key = (mmu.oam.generation, size_select)
+        if key == self.obj_key:
+            return self.obj_lines
+        self.obj_key = key
+
+        height = 16 if size_select else 8
+        lines = [[] for _ in range(HEIGHT)]
+        obj_map = mmu.oam.mem
+        for i in range(0, len(obj_map), 4):
+            X, Y, idx, flags = load_sprite(obj_map[i:i+4])
+            top = Y - 16
+            # hardware picks the first 10 sprites on a line in OAM order,
+            # off-screen X positions included
+            for y in range(max(top, 0), min(top + height, HEIGHT)):
+                if len(lines[y]) < OBJ_PER_LINE:
+                    lines[y].append((X, i, top, idx, flags))
+        for line in lines:
+            # lower X (then OAM index) wins, so it is drawn last
+            line.sort(reverse=True)
+        self.obj_lines = lines
+        return lines
 
     def get_palette(self, palette_reg: DisplayIO):
         bgp = self.regs[palette_reg]
         return [bgp & 3, (bgp >> 2) & 3, (bgp >> 4) & 3, (bgp >> 6) & 3]
 
-    def render_bg(self, display, tiles, tile_map, offset):
-        palette = self.get_palette(DisplayIO.BGP)
+    def render_map(self, tiles, tile_map, offset):
+        # renders a full 256x256 tile map into a flat row-major buffer
+        palette = bytes(self.get_palette(DisplayIO.BGP) + [0] * 252)
 
-        bg = [[0] * 256 for _ in range(256)]
+        pixels = bytearray(256 * 256)
         for i, tile_idx in enumerate(tile_map):
             tile = tiles[(tile_idx + offset) % 256]
             x, y = i % 32, i // 32
-            for j in range(8):
-                for k in range(8):
-                    bg[(x * 8) + j][(y * 8) + k] = palette[tile[k][j]]
+            for k in range(8):
+                base = (y * 8 + k) * 256 + x * 8
+                pixels[base:base + 8] = tile[k]
+        return pixels.translate(palette)
 
-        for j in range(144):
+    def render_bg(self, frame, tiles, tile_map, offset):
+        bg = self.render_map(tiles, tile_map, offset)
+
+        for j in range(HEIGHT):
             scx, scy = self.scs[j]
-            for i in range(160):
-                display[i][j] = bg[(i + scx) % 256][(j + scy) % 256]
+            base = ((j + scy) % 256) * 256
+            line = bg[base + scx:base + 256] + bg[base:base + scx]
+            frame[j * WIDTH:(j + 1) * WIDTH] = line[:WIDTH]
 
-    def render_window(self, display, tiles, tile_map, offset):
-        palette = self.get_palette(DisplayIO.BGP)
-
-        window = [[0] * 256 for _ in range(256)]
-        for i, tile_idx in enumerate(tile_map):
-            tile = tiles[(tile_idx + offset) % 256]
-            x, y = i % 32, i // 32
-            for j in range(8):
-                for k in range(8):
-                    window[(x * 8) + j][(y * 8) + k] = palette[tile[k][j]]
+    def render_window(self, frame, tiles, tile_map, offset):
+        window = self.render_map(tiles, tile_map, offset)
 
         wx = self.regs[DisplayIO.WX] - 7
         wy = self.regs[DisplayIO.WY]
-
-        for i in range(160):
-            if wx + i >= 160:
-                break
-            for j in range(144):
-                if wy + j >= 144:
-                    break
-                display[i + wx][j + wy] = window[i][j]
-
-    def render_obj(self, display, tiles, sprites, size_select):
-        palette_0 = self.get_palette(DisplayIO.OBP0)
-        palette_1 = self.get_palette(DisplayIO.OBP0)
-
-        for X,Y,idx,flags in reversed(sorted(sprites)):
-            if 0 in (X, Y):
-                continue
-            x_flip = (flags & (1 << 5)) != 0
-            y_flip = (flags & (1 << 6)) != 0
-            palette = palette_0 if flags & 0x10 == 0 else palette_1
-
-            tile = tiles[idx] + tiles[idx + 1] if size_select else tiles[idx]
-            X -= 8
-            Y -= 16
-            width = 8
-            height = 16 if size_select else 8
-            for i in range(width):
-                for j in range(height):
-                    x_off = width - i - 1 if x_flip else i
-                    y_off = height - j - 1 if y_flip else j
-                    x = X + x_off
-                    y = Y + y_off
-                    color = tile[j][i]
-                    if 0 <= x < 160 and 0 <= y < 144 and color != 0:
-                        display[x][y] = palette[color]
+        if wx >= WIDTH:
+            return
+
+        x0 = max(wx, 0)
+        for j in range(wy, HEIGHT):
+            base = (j - wy) * 256
+            frame[j * WIDTH + x0:(j + 1) * WIDTH] = window[base + x0 - wx:base + WIDTH - wx]
+
+    def render_obj(self, frame, mmu: MMU, size_select: bool):
+        palettes = [
+            bytes(self.get_palette(DisplayIO.OBP0) + [0] * 252),
+            bytes(self.get_palette(DisplayIO.OBP1) + [0] * 252),
+        ]
+
+        for y, line in enumerate(self.sprite_lines(mmu, size_select)):
+            base = y * WIDTH
+            for X, _, top, idx, flags in line:
+                X -= 8
+                x0, x1 = max(X, 0), min(X + 8, WIDTH)
+                if x0 >= x1:
+                    continue
+                flip = (flags & (X_FLIP | Y_FLIP)) >> 5
+                if size_select:
+                    top_tile = self.get_variants(mmu, idx & 0xFE)[flip]
+                    bottom_tile = self.get_variants(mmu, idx | 1)[flip]
+                    if flags & Y_FLIP:
+                        rows = bottom_tile + top_tile
+                    else:
+                        rows = top_tile + bottom_tile
+                else:
+                    rows = self.get_variants(mmu, idx)[flip]
+                row = rows[y - top]
+                shades = row.translate(palettes[(flags & OBJ_PALETTE) != 0])
+                if 0 not in row:
+                    frame[base + x0:base + x1] = shades[x0 - X:x1 - X]
+                    continue
+                for x in range(x0, x1):
+                    if row[x - X]:
+                        frame[base + x] = shades[x - X]
+
+    def unchanged(self, mmu: MMU) -> bool:
+        damage = (mmu.vram.generation, mmu.oam.generation, self.generation)
+        if damage == self.drawn and self.scs == self.drawn_scs:
+            return True
+        self.drawn = damage
+        self.drawn_scs = list(self.scs)
+        return False
 
     def draw_display(self, mmu: MMU):
         lcdc = LCDC(self.regs[DisplayIO.LCDC])
-        display = [[0] * 144 for _ in range(160)]
+        display = self.frame
+        display[:] = bytes(FRAME_SIZE)
 
         if LCDC.BG_WINDOW_DATA_SELECT in lcdc:
             bg_window_data_range = (0x8000, 0x8FFF)
@@ -181,11 +275,7 @@ class GPU:
             self.render_bg(display, bg_window_tiles, tile_map, offset)
 
         if LCDC.OBJ_DISPLAY in lcdc:
-            obj_tile_data = get_mem(mmu.vram, (0x8000, 0x8FFF))
-            obj_tiles = load_tiles(obj_tile_data)
-            obj_map = mmu.oam.mem
-            sprites = [load_sprite(obj_map[i:i+4]) for i in range(0, len(obj_map), 4)]
-            self.render_obj(display, obj_tiles, sprites, LCDC.OBJ_SIZE_SELECT in lcdc)
+            self.render_obj(display, mmu, LCDC.OBJ_SIZE_SELECT in lcdc)
 
         if LCDC.WINDOW_DISPLAY in lcdc:
             bg_window_data = get_mem(mmu.vram, bg_window_data_range)
@@ -204,28 +294,67 @@ class GPU:
         self.next_ly -= 1
         if self.next_ly == 0:
             self.next_ly = LY_CLKS
+            return self.next_line(cpu, mmu)
+        return False
 
-            if self.regs[DisplayIO.LY] < 144:
-                scx = self.regs[DisplayIO.SCX]
-                scy = self.regs[DisplayIO.SCY]
-                self.scs[self.regs[DisplayIO.LY]] = (scx, scy)
+    def advance(self, cpu: CPU, mmu: MMU, ticks: int) -> bool:
+        # same as `ticks` calls to step
+        self.next_ly -= ticks
+        done = False
+        while self.next_ly <= 0:
+            self.next_ly += LY_CLKS
+            done |= self.next_line(cpu, mmu)
+        return done
+
+    def next_line(self, cpu: CPU, mmu: MMU) -> bool:
+        if self.regs[DisplayIO.LY] < 144:
+            scx = self.regs[DisplayIO.SCX]
+            scy = self.regs[DisplayIO.SCY]
+            self.scs[self.regs[DisplayIO.LY]] = (scx, scy)
+
+        self.regs[DisplayIO.LY] += 1
+
+        if self.regs[DisplayIO.LY] > LY_END:
+            self.regs[DisplayIO.LY] = 0
+        if self.regs[DisplayIO.LY] == self.regs[DisplayIO.LYC]:
+            cpu.request_interrupt(Interrupt.LCD_STAT)
+        if self.regs[DisplayIO.LY] == VBLANK_START:
+            self.frames += 1
+            cpu.request_interrupt(Interrupt.VBLANK)
+            if not self.lcd.wants_frames:
+                return self.lcd.vblank(self, mmu)
+            if self.unchanged(mmu):
+                self.frames_skipped += 1
+                return self.lcd.keep_display()
+            return self.draw_display(mmu)
+        return False
 
-            self.regs[DisplayIO.LY] += 1
+RENDERERS = ["auto", "numpy", "python"]
 
-            if self.regs[DisplayIO.LY] > LY_END:
-                self.regs[DisplayIO.LY] = 0
-            if self.regs[DisplayIO.LY] == self.regs[DisplayIO.LYC]:
-                cpu.request_interrupt(Interrupt.LCD_STAT)
-            if self.regs[DisplayIO.LY] == VBLANK_START:
-                cpu.request_interrupt(Interrupt.VBLANK)
-                return self.draw_display(mmu)
+def make_gpu(lcd: Sink, renderer: str = "auto") -> GPU:
+    if renderer == "auto" and not lcd.wants_frames:
+        # nothing gets drawn, so don't pay for importing numpy
+        return GPU(lcd)
+    if renderer in ("auto", "numpy"):
+        try:
+            from .gpu_np import NumpyGPU
+            return NumpyGPU(lcd)
+        except ImportError:
+            if renderer == "numpy":
+                raise
+    return GPU(lcd)
 
-        return False
+
+OAM_SIZE = 0xA0
+# 160 machine cycles
+DMA_TICKS = OAM_SIZE * 4
 
 class DisplayIOHandler(IOHandler):
-    def __init__(self, gpu: GPU, mmu: MMU):
+    def __init__(self, gpu: GPU, mmu: MMU, sched: Scheduler):
         self.gpu = gpu
         self.mmu = mmu
+        self.sched = sched
+        sched.register("dma", self.dma_done)
     def __contains__(self, addr: int) -> bool:
         return addr in DISPLAY_IO_ADDRS
     def load(self, addr: int) -> int:
@@ -237,16 +366,30 @@ class DisplayIOHandler(IOHandler):
             return self.gpu.regs[port]
     def store(self, addr: int, val: int):
         port = DisplayIO(addr)
-        if port is DisplayIO.STAT:
-            print("STAT: ${:02X}".format(val))
         if port is DisplayIO.DMA:
-            src_start = val << 8
-            dst_start = 0xFE00
-            for i in range(0xA0):
-                v = self.mmu.load(src_start + i)
-                self.mmu.store(dst_start + i, v)
+            self.dma(val << 8)
         else:
             mask = DISPLAY_MASK.get(port, 0xff)
             inv_mask = (~mask) & 0xff
             old = self.gpu.regs[port]
-            self.gpu.regs[port] = (val & mask) | (old & inv_mask)
+            new = (val & mask) | (old & inv_mask)
+            self.gpu.regs[port] = new
+            if new != old and port in DAMAGE_REGS:
+                self.gpu.generation += 1
+
+    def dma(self, src: int):
+        # the copy is done at once; for the DMA_TICKS it takes on hardware
+        # only oam is locked. the rest of the bus lockout (the cpu limited to
+        # hram) isn't modelled: rom, ram and vram, decoded fetches included,
+        # stay usable, which is what games running their wait loop from
+        # hram see anyway
+        data = self.mmu.view(src, OAM_SIZE)
+        if data is None:
+            # io, cart ram and unmapped sources go through the checked path
+            data = bytes(self.mmu.load(src + i) for i in range(OAM_SIZE))
+        self.mmu.oam.store_block(self.mmu.oam.lower, data)
+        self.mmu.oam.locked = True
+        self.sched.schedule("dma", DMA_TICKS)
+
+    def dma_done(self):
+        self.mmu.oam.locked = False
@@ -0,0 +1,127 @@
+from collections import defaultdict
+
+import numpy as np
+
+from .gpu import GPU, LCDC, BGMAP_1, BGMAP_2, OBJ_PALETTE, X_FLIP, Y_FLIP, get_mem
+from .io import DisplayIO
+from .lcd import HEIGHT, WIDTH, Sink
+from .mmu import MMU, VIDEO_RAM
+
+NUM_TILES = 384
+TILE_DATA_END = 0x97FF
+
+# decoded pixel row for every (hi << 8 | lo) pair of tile bytes, built
+# from the bits of each byte so import stays cheap
+BYTE_BITS = ((np.arange(256)[:, None] >> (7 - np.arange(8))) & 1).astype(np.uint8)
+ROW_LUT = (BYTE_BITS[None, :, :] | (BYTE_BITS[:, None, :] << 1)).reshape(1 << 16, 8)
+
+LINES = np.arange(HEIGHT)[:, None]
+COLUMNS = np.arange(WIDTH)[None, :]
+
+
+def runs(lines):
+    # splits sorted line numbers into [start, end) ranges of consecutive lines
+    start = prev = lines[0]
+    for y in lines[1:]:
+        if y != prev + 1:
+            yield start, prev + 1
+            start = y
+        prev = y
+    yield start, prev + 1
+
+
+def palette_lut(reg: int):
+    return np.array([reg & 3, (reg >> 2) & 3, (reg >> 4) & 3, (reg >> 6) & 3], dtype=np.uint8)
+
+
+class NumpyGPU(GPU):
+    """vectorized renderer, pixel-compatible with the pure python GPU"""
+    def __init__(self, lcd: Sink):
+        super().__init__(lcd)
+        self.tiles = np.zeros((NUM_TILES, 8, 8), dtype=np.uint8)
+        self.screen = np.frombuffer(self.frame, dtype=np.uint8).reshape(HEIGHT, WIDTH)
+        self.vram = None
+
+    def attach(self, mmu: MMU):
+        self.vram = mmu.vram.mem
+        self.decode_tiles()
+        super().attach(mmu)
+
+    def invalidate(self, mmu: MMU):
+        super().invalidate(mmu)
+        self.decode_tiles()
+
+    def decode_tiles(self):
+        data = np.frombuffer(bytes(self.vram[:NUM_TILES * 16]), dtype=np.uint8)
+        pairs = data[0::2].astype(np.uint32) | (data[1::2].astype(np.uint32) << 8)
+        self.tiles[:] = ROW_LUT[pairs].reshape(NUM_TILES, 8, 8)
+
+    def vram_written(self, addr: int, val: int):
+        super().vram_written(addr, val)
+        if addr > TILE_DATA_END:
+            return
+        off = (addr - VIDEO_RAM) & ~1
+        self.tiles[off >> 4, (off >> 1) & 7] = ROW_LUT[self.vram[off] | (self.vram[off + 1] << 8)]
+
+    def tile_map(self, mmu: MMU, high: bool, signed: bool):
+        tile_map = np.frombuffer(get_mem(mmu.vram, BGMAP_2 if high else BGMAP_1), dtype=np.uint8)
+        idx = tile_map.astype(np.intp)
+        if signed:
+            idx = np.where(idx < 128, idx + 256, idx)
+        return self.tiles[idx].reshape(32, 32, 8, 8).transpose(0, 2, 1, 3).reshape(256, 256)
+
+    def render_obj(self, colors, mmu: MMU, size_select: bool):
+        palettes = [palette_lut(self.regs[DisplayIO.OBP0]), palette_lut(self.regs[DisplayIO.OBP1])]
+
+        # draw each sprite on the lines it was selected for, in priority order
+        selected = defaultdict(list)
+        for y, line in enumerate(self.sprite_lines(mmu, size_select)):
+            for sprite in line:
+                selected[sprite].append(y)
+
+        for sprite in sorted(selected, reverse=True):
+            X, _, top, idx, flags = sprite
+            if size_select:
+                tile = self.tiles[idx & 0xFE:(idx & 0xFE) + 2].reshape(16, 8)
+            else:
+                tile = self.tiles[idx]
+            if flags & X_FLIP:
+                tile = tile[:, ::-1]
+            if flags & Y_FLIP:
+                tile = tile[::-1]
+            X -= 8
+            x0, x1 = max(X, 0), min(X + 8, WIDTH)
+            if x0 >= x1:
+                continue
+            palette = palettes[(flags & OBJ_PALETTE) != 0]
+            for y0, y1 in runs(selected[sprite]):
+                pixels = tile[y0 - top:y1 - top, x0 - X:x1 - X]
+                mask = pixels != 0
+                colors[y0:y1, x0:x1][mask] = palette[pixels[mask]]
+
+    def draw_display(self, mmu: MMU):
+        lcdc = LCDC(self.regs[DisplayIO.LCDC])
+        signed = LCDC.BG_WINDOW_DATA_SELECT not in lcdc
+        bgp = palette_lut(self.regs[DisplayIO.BGP])
+        shades = np.zeros((HEIGHT, WIDTH), dtype=np.uint8)
+
+        if LCDC.BG_DISPLAY in lcdc:
+            bg = self.tile_map(mmu, LCDC.BG_TILE_SELECT in lcdc, signed)
+            scs = np.array(self.scs, dtype=np.intp)
+            rows = (LINES + scs[:, 1:2]) % 256
+            cols = (COLUMNS + scs[:, 0:1]) % 256
+            shades = bgp[bg[rows, cols]]
+
+        if LCDC.OBJ_DISPLAY in lcdc:
+            self.render_obj(shades, mmu, LCDC.OBJ_SIZE_SELECT in lcdc)
+
+        if LCDC.WINDOW_DISPLAY in lcdc:
+            window = bgp[self.tile_map(mmu, LCDC.WINDOW_TILE_SELECT in lcdc, signed)]
+            wx = self.regs[DisplayIO.WX] - 7
+            wy = self.regs[DisplayIO.WY]
+            x0 = max(wx, 0)
+            if wx < WIDTH and wy < HEIGHT:
+                shades[wy:, x0:] = window[:HEIGHT - wy, x0 - wx:WIDTH - wx]
+
+        self.screen[:] = shades
+        return self.lcd.draw_display(self.frame)
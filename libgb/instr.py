@@ -393,7 +393,7 @@ def cp(lhs: ops.Operand, rhs: ops.Operand):
     return f
 
 
-def rlc(ctx: ops.Ctx, op: ops.Operand) -> str:
+def rlc(ctx: ops.Ctx, op: ops.Operand):
     val = op.load(ctx)
     MSB = (val & 0x80) >> 7
     op.store(ctx, val << 1 | MSB)
@@ -404,10 +404,8 @@ def rlc(ctx: ops.Ctx, op: ops.Operand) -> str:
     ctx.regs.set_flag(Flag.H, False)
     ctx.regs.set_flag(Flag.Z, res == 0)
 
-    return "RLC {}".format(op)
 
-
-def rrc(ctx: ops.Ctx, op: ops.Operand) -> str:
+def rrc(ctx: ops.Ctx, op: ops.Operand):
     val = op.load(ctx)
     LSB = val & 1
     op.store(ctx, val >> 1 | (LSB << 7))
@@ -418,10 +416,8 @@ def rrc(ctx: ops.Ctx, op: ops.Operand) -> str:
     ctx.regs.set_flag(Flag.H, False)
     ctx.regs.set_flag(Flag.Z, res == 0)
 
-    return "RRC {}".format(op)
-
 
-def rl(ctx: ops.Ctx, op: ops.Operand) -> str:
+def rl(ctx: ops.Ctx, op: ops.Operand):
     val = op.load(ctx)
     MSB = (val & 0x80) >> 7
     C = int(ctx.regs.get_flag(Flag.C))
@@ -433,10 +429,8 @@ def rl(ctx: ops.Ctx, op: ops.Operand) -> str:
     ctx.regs.set_flag(Flag.H, False)
     ctx.regs.set_flag(Flag.Z, res == 0)
 
-    return "RL {}".format(op)
 
-
-def rr(ctx: ops.Ctx, op: ops.Operand) -> str:
+def rr(ctx: ops.Ctx, op: ops.Operand):
     val = op.load(ctx)
     LSB = val & 1
     C = int(ctx.regs.get_flag(Flag.C))
@@ -448,10 +442,8 @@ def rr(ctx: ops.Ctx, op: ops.Operand) -> str:
     ctx.regs.set_flag(Flag.H, False)
     ctx.regs.set_flag(Flag.Z, res == 0)
 
-    return "RR {}".format(op)
-
 
-def sla(ctx: ops.Ctx, op: ops.Operand) -> str:
+def sla(ctx: ops.Ctx, op: ops.Operand):
     val = op.load(ctx)
     op.store(ctx, val << 1)
     res = op.load(ctx)
@@ -461,10 +453,8 @@ def sla(ctx: ops.Ctx, op: ops.Operand) -> str:
     ctx.regs.set_flag(Flag.H, False)
     ctx.regs.set_flag(Flag.Z, res == 0)
 
-    return "SLA {}".format(op)
 
-
-def sra(ctx: ops.Ctx, op: ops.Operand) -> str:
+def sra(ctx: ops.Ctx, op: ops.Operand):
     val = op.load(ctx)
     op.store(ctx, val >> 1 | (val & 0x80))
     res = op.load(ctx)
@@ -474,10 +464,8 @@ def sra(ctx: ops.Ctx, op: ops.Operand) -> str:
     ctx.regs.set_flag(Flag.H, False)
     ctx.regs.set_flag(Flag.Z, res == 0)
 
-    return "SRA {}".format(op)
-
 
-def swap(ctx: ops.Ctx, op: ops.Operand) -> str:
+def swap(ctx: ops.Ctx, op: ops.Operand):
     val = op.load(ctx)
     res = (val << 4 & 0xf0) | (val >> 4)
     op.store(ctx, res)
@@ -487,10 +475,8 @@ def swap(ctx: ops.Ctx, op: ops.Operand) -> str:
     ctx.regs.set_flag(Flag.H, False)
     ctx.regs.set_flag(Flag.Z, res == 0)
 
-    return "SWAP {}".format(op)
-
 
-def srl(ctx: ops.Ctx, op: ops.Operand) -> str:
+def srl(ctx: ops.Ctx, op: ops.Operand):
     val = op.load(ctx)
     res = val >> 1
     op.store(ctx, res)
@@ -500,10 +486,8 @@ def srl(ctx: ops.Ctx, op: ops.Operand) -> str:
     ctx.regs.set_flag(Flag.H, False)
     ctx.regs.set_flag(Flag.Z, res == 0)
 
-    return "SRL {}".format(op)
 
-
-def bit(ctx: ops.Ctx, n: int, op: ops.Operand) -> str:
+def bit(ctx: ops.Ctx, n: int, op: ops.Operand):
     val = op.load(ctx)
     mask = 1 << n
 
@@ -511,48 +495,53 @@ def bit(ctx: ops.Ctx, n: int, op: ops.Operand) -> str:
     ctx.regs.set_flag(Flag.H, True)
     ctx.regs.set_flag(Flag.Z, (val & mask) == 0)
 
-    return "BIT {},{}".format(n, op)
-
 
-def res(ctx: ops.Ctx, n: int, op: ops.Operand) -> str:
+def res(ctx: ops.Ctx, n: int, op: ops.Operand):
     val = op.load(ctx)
     mask = ~(1 << n)
     op.store(ctx, val & mask)
 
-    return "RES {},{}".format(n, op)
-
 
-def set_(ctx: ops.Ctx, n: int, op: ops.Operand) -> str:
+def set_(ctx: ops.Ctx, n: int, op: ops.Operand):
     val = op.load(ctx)
     mask = 1 << n
     op.store(ctx, val | mask)
 
-    return "SET {},{}".format(n, op)
-
 
 CB_ARITH = [rlc, rrc, rl, rr, sla, sra, swap, srl]
+CB_NAMES = ["RLC", "RRC", "RL", "RR", "SLA", "SRA", "SWAP", "SRL"]
 
 
-def cb_prefix(ctx: ops.Ctx) -> Instr:
-    cb_op = ops.imm8.load(ctx)
-    op_idx = cb_op & 0b111
-    op = REG_DECODE_TABLE[op_idx]
-    cycles = 8 + op.cost() * 2
+def mk_cb(cb_op: int):
+    # decoded once: the operand, cycles and mnemonic only depend on cb_op
+    op = REG_DECODE_TABLE[cb_op & 0b111]
     n = (cb_op >> 3) & 0b111
+    cycles = 8 + op.cost() * 2
     if cb_op < 0x40:
-        mnem = CB_ARITH[n](ctx, op)
-        return Instr(cycles, 2, mnem)
-    elif cb_op < 0x80:
-        mnem = bit(ctx, n, op)
-        return Instr(cycles, 2, mnem)
+        run = CB_ARITH[n]
+        inst = Instr(cycles, 2, "{} {}".format(CB_NAMES[n], op))
+        def f(ctx: ops.Ctx) -> Instr:
+            run(ctx, op)
+            return inst
+        return f
+    if cb_op < 0x80:
+        run, name = bit, "BIT"
     elif cb_op < 0xC0:
-        mnem = res(ctx, n, op)
-        return Instr(cycles, 2, mnem)
-    elif cb_op <= 0xFF:
-        mnem = set_(ctx, n, op)
-        return Instr(cycles, 2, mnem)
+        run, name = res, "RES"
+    else:
+        run, name = set_, "SET"
+    inst = Instr(cycles, 2, "{} {},{}".format(name, n, op))
+    def f(ctx: ops.Ctx) -> Instr:
+        run(ctx, n, op)
+        return inst
+    return f
 
-    return Instr(-1, 2, "CB {}".format(ops.imm8.fmt(ctx)))
+
+CB_TABLE = [mk_cb(cb_op) for cb_op in range(0x100)]
+
+
+def cb_prefix(ctx: ops.Ctx) -> Instr:
+    return CB_TABLE[ops.imm8.load(ctx)](ctx)
 
 
 def rlca(ctx: ops.Ctx):
@@ -636,7 +625,7 @@ def di(ctx: ops.Ctx) -> Instr:
 
 
 def ei(ctx: ops.Ctx) -> Instr:
-    ctx.regs.IME = True
+    ctx.regs.ei()
     return Instr(4, 1, "EI")
 
 
@@ -780,6 +769,18 @@ OP_TABLE[0xFE] = cp(ops.A, ops.imm8)
 for i in range(8):
     OP_TABLE[RST_START + i * 8] = mk_rst(i * 8)
 
+# operand bytes per opcode, so code can be decoded without running it
+IMM8_OPS = [0x06, 0x0E, 0x16, 0x1E, 0x26, 0x2E, 0x36, 0x3E, 0x10, 0x18, 0x20, 0x28, 0x30, 0x38,
+            0xC6, 0xCE, 0xD6, 0xDE, 0xE6, 0xEE, 0xF6, 0xFE, 0xE0, 0xF0, 0xE8, 0xF8, CB_PREFIX]
+IMM16_OPS = [0x01, 0x11, 0x21, 0x31, 0x08, 0xC2, 0xCA, 0xD2, 0xDA, JP, 0xC4, 0xCC, 0xD4, 0xDC, CALL,
+             0xEA, 0xFA]
+
+OP_LENGTH = [1] * 256
+for op in IMM8_OPS:
+    OP_LENGTH[op] = 2
+for op in IMM16_OPS:
+    OP_LENGTH[op] = 3
+
 
 UNUSED = [0xd3, 0xdb, 0xdd, 0xe3, 0xe4, 0xeb, 0xec, 0xed, 0xf4, 0xfc, 0xfd]
 def diag():
@@ -803,3 +804,8 @@ def exec_instr(op: int, regs: Regs, mmu: MMU) -> Instr:
     handler = OP_TABLE[op]
     ctx = ops.Ctx(regs, mmu)
     return handler(ctx)
+
+
+def exec_decoded(entry, regs: Regs, mmu: MMU) -> Instr:
+    # entry is a decode.Decoded: no fetch, and operands come with it
+    return entry.handler(ops.Ctx(regs, mmu, entry.imm))
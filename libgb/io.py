@@ -79,7 +79,12 @@ class IOHandler(ABC):
 
 class IOPorts(memory.MemoryRegion):
     name = "io-ports"
-    handlers: List[IOHandler] = []
+    handlers: List[IOHandler]
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # per instance: several gameboys can live in one process
+        self.handlers = []
 
     def __contains__(self, addr: int) -> bool:
         return super().__contains__(addr) or addr == 0xFFFF
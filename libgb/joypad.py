@@ -1,42 +1,136 @@
-import pygame
+from abc import ABC, abstractmethod
+from typing import Iterable, Tuple
 
+from .cpu import CPU, Interrupt
+from .gpu import LY_CLKS, LY_END
 from .io import IOHandler, JoypadIO
+from .sched import Scheduler
 
 JOYP_DIR_FLAG = 1 << 4
 JOYP_BUTTON_FLAG = 1 << 5
 JOYP_MODE_MASK = JOYP_DIR_FLAG | JOYP_BUTTON_FLAG
 
+# host input is sampled once per frame by default
+FRAME_TICKS = LY_CLKS * (LY_END + 1)
+
+# pygame key names, resolved lazily so headless runs never import pygame
 DIR_KEYS = {
-    pygame.K_RIGHT: 1 << 0,
-    pygame.K_LEFT: 1 << 1,
-    pygame.K_UP: 1 << 2,
-    pygame.K_DOWN: 1 << 3,
+    "K_RIGHT": 1 << 0,
+    "K_LEFT": 1 << 1,
+    "K_UP": 1 << 2,
+    "K_DOWN": 1 << 3,
 }
 
 BUTTON_KEYS = {
-    pygame.K_z: 1 << 0,
-    pygame.K_x: 1 << 1,
-    pygame.K_RSHIFT: 1 << 2,
-    pygame.K_RETURN: 1 << 3,
+    "K_z": 1 << 0,
+    "K_x": 1 << 1,
+    "K_RSHIFT": 1 << 2,
+    "K_RETURN": 1 << 3,
 }
 
+
+class InputSource(ABC):
+    """button masks (directions in the low nibble, buttons in the high one)"""
+    @abstractmethod
+    def mask(self, frame: int) -> int:
+        pass
+
+
+class KeyboardInput(InputSource):
+    def __init__(self):
+        import pygame
+        self.get_pressed = pygame.key.get_pressed
+        self.dir_keys = {getattr(pygame, k): f for k, f in DIR_KEYS.items()}
+        self.button_keys = {getattr(pygame, k): f for k, f in BUTTON_KEYS.items()}
+
+    def mask(self, frame: int) -> int:
+        keys = self.get_pressed()
+        pressed = 0
+        for dir, flag in self.dir_keys.items():
+            if keys[dir]:
+                pressed |= flag
+        for button, flag in self.button_keys.items():
+            if keys[button]:
+                pressed |= flag << 4
+        return pressed
+
+
+class ScriptedInput(InputSource):
+    """plays (frame, mask) change events, precomputed into one mask per frame"""
+    def __init__(self, events: Iterable[Tuple[int, int]] = ()):
+        events = sorted(events)
+        end = events[-1][0] + 1 if events else 0
+        self.masks = bytearray(end)
+        for (frame, mask), nxt in zip(events, events[1:] + [(end, 0)]):
+            self.masks[frame:nxt[0]] = bytes([mask]) * (nxt[0] - frame)
+        # held after the last event
+        self.last = events[-1][1] if events else 0
+
+    def mask(self, frame: int) -> int:
+        if frame < len(self.masks):
+            return self.masks[frame]
+        return self.last
+
+
 class JoypadIOHandler(IOHandler):
+    """samples its input source every `poll_ticks` instead of on JOYP reads
+
+    the sample is cached as active-low direction and button nibbles, and
+    JOYPAD_INT is requested when a selected line goes from high to low.
+    """
     mode: int
-    def __init__(self):
+    def __init__(self, gpu, cpu: CPU, sched: Scheduler, source: InputSource = None,
+                 poll_ticks: int = FRAME_TICKS):
         self.mode = 0
+        self.gpu = gpu
+        self.cpu = cpu
+        self.sched = sched
+        self.source = ScriptedInput() if source is None else source
+        self.poll_ticks = poll_ticks
+        self._forced = None
+        self.mask = 0
+        self.dirs = self.buttons = self.lines = 0xf
+        sched.register("joypad-poll", self.poll_due)
+        self.sample()
+        sched.schedule("joypad-poll", poll_ticks)
+    @property
+    def forced(self):
+        # button mask that overrides the source, for rewind and vec
+        return self._forced
+    @forced.setter
+    def forced(self, mask):
+        self._forced = mask
+        self.sample()
     def __contains__(self, addr: int) -> bool:
         return addr == JoypadIO.JOYP.value
+    def poll(self) -> int:
+        # the source's mask for the current frame
+        return self.source.mask(self.gpu.frames)
+    def pressed(self) -> int:
+        if self._forced is not None:
+            return self._forced
+        return self.poll()
+    def poll_due(self):
+        self.sample()
+        self.sched.schedule("joypad-poll", self.poll_ticks)
+    def sample(self):
+        self.set_mask(self.pressed())
+        self.update()
+    def set_mask(self, mask: int):
+        self.mask = mask
+        self.dirs = ~mask & 0xf
+        self.buttons = ~(mask >> 4) & 0xf
+    def update(self):
+        lines = 0xf
+        if (self.mode & JOYP_DIR_FLAG) == 0:
+            lines &= self.dirs
+        if (self.mode & JOYP_BUTTON_FLAG) == 0:
+            lines &= self.buttons
+        if self.lines & ~lines:
+            self.cpu.request_interrupt(Interrupt.JOYPAD)
+        self.lines = lines
     def load(self, addr: int) -> int:
-        keys = pygame.key.get_pressed()
-        joyp = self.mode | 0xf
-        if (joyp & JOYP_DIR_FLAG) == 0:
-            for dir, flag in DIR_KEYS.items():
-                if keys[dir]:
-                    joyp &= ~flag
-        if (joyp & JOYP_BUTTON_FLAG) == 0:
-            for button, flag in BUTTON_KEYS.items():
-                if keys[button]:
-                    joyp &= ~flag
-        return joyp
+        return self.mode | self.lines
     def store(self, addr: int, val: int):
         self.mode = val & JOYP_MODE_MASK
+        self.update()
@@ -1,38 +1,147 @@
-from typing import List
+from abc import ABC, abstractmethod
+import struct
+from typing import Callable, Optional
+import zlib
 
-import pygame
+WIDTH = 160
+HEIGHT = 144
+DIMENSION = (WIDTH, HEIGHT)
 
-DIMENSION = (160, 144)
+# frames are a flat, row-major bytearray of WIDTH * HEIGHT shades (0-3)
+FRAME_SIZE = WIDTH * HEIGHT
 
-class LCD:
+SHADES = [(3 - shade) * 85 for shade in range(4)]
+GRAY = bytes(SHADES + [0] * 252)
+
+
+class Sink(ABC):
+    # the gpu skips composing frames entirely for sinks that don't want them
+    wants_frames = True
+
+    @abstractmethod
+    def draw_display(self, frame: bytearray) -> bool:
+        # returns True when the user asked to quit
+        pass
+
+    def keep_display(self) -> bool:
+        # called instead of draw_display when the frame didn't change
+        return False
+
+    def vblank(self, gpu, mmu) -> bool:
+        # called at VBLANK instead, for sinks that don't want frames
+        return False
+
+    def inputs(self):
+        # the joypad's InputSource when none is given, if the sink has one
+        return None
+
+    def close(self):
+        pass
+
+
+class NullSink(Sink):
+    wants_frames = False
+
+    def draw_display(self, frame: bytearray) -> bool:
+        return False
+
+
+class CallbackSink(Sink):
+    def __init__(self, callback: Callable[[bytearray], Optional[bool]]):
+        self.callback = callback
+
+    def draw_display(self, frame: bytearray) -> bool:
+        return bool(self.callback(frame))
+
+
+class BufferSink(Sink):
+    """copies every new frame into a caller-owned buffer of FRAME_SIZE bytes"""
+    def __init__(self, out):
+        self.out = out
+
+    def draw_display(self, frame: bytearray) -> bool:
+        self.out[:] = frame
+        return False
+
+
+class ImageSink(Sink):
+    """keeps the latest frame and only encodes it when asked to"""
     def __init__(self):
+        self.frame = bytearray(FRAME_SIZE)
+
+    def draw_display(self, frame: bytearray) -> bool:
+        self.frame[:] = frame
+        return False
+
+    def to_ppm(self) -> bytes:
+        header = "P5 {} {} 255\n".format(WIDTH, HEIGHT).encode()
+        return header + self.frame.translate(GRAY)
+
+    def to_png(self) -> bytes:
+        gray = self.frame.translate(GRAY)
+        raw = b"".join(b"\x00" + gray[y * WIDTH:(y + 1) * WIDTH] for y in range(HEIGHT))
+        ihdr = struct.pack(">IIBBBBB", WIDTH, HEIGHT, 8, 0, 0, 0, 0)
+        return b"\x89PNG\r\n\x1a\n" + b"".join([
+            png_chunk(b"IHDR", ihdr),
+            png_chunk(b"IDAT", zlib.compress(raw)),
+            png_chunk(b"IEND", b""),
+        ])
+
+    def save(self, path: str):
+        data = self.to_png() if path.endswith(".png") else self.to_ppm()
+        with open(path, "wb") as f:
+            f.write(data)
+
+
+def png_chunk(kind: bytes, data: bytes) -> bytes:
+    crc = zlib.crc32(kind + data)
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", crc)
+
+
+RGBA = [bytes([p, p, p, 0xff]) for p in SHADES]
+
+class LCD(Sink):
+    def __init__(self):
+        import pygame
+        self.pygame = pygame
+
         pygame.init()
         pygame.display.set_caption("gb.py")
 
         self.screen = pygame.display.set_mode(DIMENSION)
-        self.pixels = pygame.PixelArray(self.screen)
+
+    def inputs(self):
+        from .joypad import KeyboardInput
+        return KeyboardInput()
 
     def wait(self):
         while True:
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
+            for event in self.pygame.event.get():
+                if event.type == self.pygame.QUIT:
                     return
 
-    def draw_display(self, display: List[List[int]]):
-        assert len(display) == 160
-        assert len(display[0]) == 144
-
-        bs = bytearray(160 * 144 * 4)
-        k = 0
-        for j in range(144):
-            for i in range(160):
-                p = (3 - display[i][j]) * 85
-                bs[k] = p
-                bs[k+1] = p
-                bs[k+2] = p
-                bs[k+3] = 0xff
-                k += 4
-
-        self.screen.get_buffer().write(bytes(bs))
-        pygame.display.flip()
-        return pygame.QUIT in [e.type for e in pygame.event.get()]
+    def draw_display(self, frame: bytearray) -> bool:
+        assert len(frame) == FRAME_SIZE
+
+        bs = b"".join([RGBA[p] for p in frame])
+
+        self.screen.get_buffer().write(bs)
+        self.pygame.display.flip()
+        return self.keep_display()
+
+    def keep_display(self) -> bool:
+        return self.pygame.QUIT in [e.type for e in self.pygame.event.get()]
+
+
+def remote_sink(renderer: str = "auto") -> Sink:
+    # imported on use, the render process side pulls in the gpu
+    from .remote import RemoteSink
+    return RemoteSink(renderer)
+
+
+SINKS = {
+    "pygame": LCD,
+    "null": NullSink,
+    "image": ImageSink,
+    "remote": remote_sink,
+}
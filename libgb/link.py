@@ -0,0 +1,135 @@
+from multiprocessing import resource_tracker, shared_memory
+import os
+import time
+
+from .sched import Scheduler
+from .serial import SerialIOHandler
+
+# the cable runs each side at most this many ticks ahead of the other.
+# transfers land on the exact tick as long as it is under half a transfer
+DEFAULT_QUANTUM = 1024
+
+# shared block: the quantum, then one mailbox per side written only by
+# that side. every field is an aligned 64 bit word, so each store is atomic
+# and the sequence number is written last
+QUANTUM = 0
+CLOCK, SEQ, BYTE, DUE, REPLY_SEQ, REPLY, CLOSED = range(7)
+FIELDS = 7
+SIZE = (1 + 2 * FIELDS) * 8
+
+
+def attach_shm(name: str) -> shared_memory.SharedMemory:
+    # the creating side owns the block; our exit mustn't unlink it
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # no `track` before python 3.13: attaching registers the block with
+        # the resource tracker, under the name with its posix leading slash
+        shm = shared_memory.SharedMemory(name=name)
+        if os.name == "posix":
+            resource_tracker.unregister("/" + shm.name, "shared_memory")
+        return shm
+
+
+class Link:
+    """link cable between two gameboys in different processes
+
+    the side driving the clock posts its byte with the tick the transfer
+    completes on; the other side swaps in its own byte when it reaches that
+    tick, and the sender blocks at completion until the reply arrives.
+    """
+    def __init__(self, shm: shared_memory.SharedMemory, side: int, owner: bool):
+        self.shm = shm
+        self.words = shm.buf.cast("Q")
+        self.quantum = self.words[QUANTUM]
+        self.side = side
+        self.owner = owner
+        self.mine = 1 + side * FIELDS
+        self.theirs = 1 + (1 - side) * FIELDS
+        self.seq = 0
+        self.seen = 0
+        self.serial = None
+        self.sched = None
+
+    @staticmethod
+    def create(quantum: int = DEFAULT_QUANTUM) -> "Link":
+        shm = shared_memory.SharedMemory(create=True, size=SIZE)
+        shm.buf[:SIZE] = bytes(SIZE)
+        shm.buf.cast("Q")[QUANTUM] = quantum
+        return Link(shm, 0, owner=True)
+
+    @staticmethod
+    def connect(name: str) -> "Link":
+        return Link(attach_shm(name), 1, owner=False)
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def attach(self, serial: SerialIOHandler, sched: Scheduler):
+        self.serial = serial
+        self.sched = sched
+        serial.link = self
+        # host events: save states and rewind leave the cable's sync alone
+        sched.register("link-sync", self.sync, host=True)
+        sched.register("link-recv", self.receive, host=True)
+        sched.schedule("link-sync", self.quantum)
+
+    def get(self, field: int) -> int:
+        return self.words[self.theirs + field]
+
+    def put(self, field: int, val: int):
+        self.words[self.mine + field] = val
+
+    def connected(self) -> bool:
+        return not self.get(CLOSED)
+
+    def incoming(self) -> bool:
+        return self.get(SEQ) > self.seen
+
+    def sync(self):
+        now = self.sched.now
+        self.put(CLOCK, now)
+        while self.connected() and self.get(CLOCK) + self.quantum < now:
+            # the other side is blocked on our reply
+            if self.incoming() and self.get(DUE) <= now:
+                self.receive()
+            time.sleep(0)
+        if self.incoming() and not self.sched.pending("link-recv"):
+            self.sched.schedule("link-recv", max(self.get(DUE) - now, 0))
+        self.sched.schedule("link-sync", self.quantum)
+
+    def receive(self):
+        if not self.incoming():
+            return
+        self.sched.cancel("link-recv")
+        seq = self.get(SEQ)
+        reply = self.serial.receive(self.get(BYTE))
+        self.seen = seq
+        self.put(REPLY, reply)
+        self.put(REPLY_SEQ, seq)
+
+    def send(self, val: int, due: int):
+        self.seq += 1
+        self.put(BYTE, val)
+        self.put(DUE, due)
+        self.put(SEQ, self.seq)
+
+    def finish(self) -> int:
+        # the byte shifted in by our transfer, once the other side got there
+        self.put(CLOCK, self.sched.now)
+        while self.connected() and self.get(REPLY_SEQ) < self.seq:
+            # both sides may be driving the clock at once
+            if self.incoming():
+                self.receive()
+            time.sleep(0)
+        if self.get(REPLY_SEQ) < self.seq:
+            return None
+        return self.get(REPLY)
+
+    def close(self):
+        self.put(CLOSED, 1)
+        self.words.release()
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
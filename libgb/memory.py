@@ -17,6 +17,9 @@ class MemoryRegion(ABC):
         pass
     def __contains__(self, addr: int) -> bool:
         return self.lower <= addr <= self.upper
+    def view(self, addr: int, size: int):
+        # backing bytes for a block read, or None if reads have side effects
+        return None
     def translate(self, addr: int) -> int:
         assert addr in self
         return addr - self.lower
@@ -31,19 +34,83 @@ class Unimplemented(MemoryRegion):
         assert 0, "!!! write in {} to 0x{:04x} = 0x{:X}".format(self.name, addr, val)
 
 class RomBank(MemoryRegion):
+    """window onto one of the rom's banks; switching banks rebinds `mem`"""
     name = "rom-bank"
-    def load(self, addr: int, bank=0) -> int:
-        base = self.size * bank
-        return self.mem[base + self.translate(addr)]
+    def __init__(self, lower: int, upper: int, banks: list, bank=0):
+        self.banks = banks
+        self.bank = bank % len(banks)
+        super().__init__(lower, upper, banks[self.bank])
+    def select(self, bank: int):
+        self.bank = bank % len(self.banks)
+        self.mem = self.banks[self.bank]
+    def load(self, addr: int) -> int:
+        return self.mem[self.translate(addr)]
+    def view(self, addr: int, size: int):
+        offset = self.translate(addr)
+        if offset + size > self.size:
+            return None
+        return self.mem[offset:offset + size]
     def store(self, addr: int, val: int):
         print("! write to {} at 0x{:04x} = 0x{:X}".format(self.name, addr, val))
 
+PAGE_BITS = 8
+PAGE_SIZE = 1 << PAGE_BITS
+
 class FixedWorkRam(MemoryRegion):
+    """plain ram; stores bump a write generation for their 256 byte page,
+    which is how code decoded out of ram notices it may be stale"""
     name = "fixed-work-ram"
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pages = [0] * ((self.size + PAGE_SIZE - 1) >> PAGE_BITS)
+    def load(self, addr: int) -> int:
+        return self.mem[self.translate(addr)]
+    def store(self, addr: int, val: int):
+        offset = self.translate(addr)
+        self.mem[offset] = val
+        self.pages[offset >> PAGE_BITS] += 1
+    def touch(self):
+        # for writes that go around store, like loading a state
+        for page in range(len(self.pages)):
+            self.pages[page] += 1
+    def view(self, addr: int, size: int):
+        offset = self.translate(addr)
+        if offset + size > self.size:
+            return None
+        return self.mem[offset:offset + size]
+
+class WatchedRam(FixedWorkRam):
+    name = "watched-ram"
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.observers = []
+        self.generation = 0
+        # set on oam while a DMA transfer is running: reads give 0xff and
+        # writes are dropped. nothing else is locked, see DisplayIOHandler.dma
+        self.locked = False
     def load(self, addr: int) -> int:
+        if self.locked:
+            return 0xff
         return self.mem[self.translate(addr)]
+    def store_block(self, addr: int, data: bytes):
+        offset = self.translate(addr)
+        if self.mem[offset:offset + len(data)] == data:
+            return
+        self.mem[offset:offset + len(data)] = data
+        self.generation += 1
+        for observer in self.observers:
+            for i, val in enumerate(data):
+                observer(addr + i, val)
     def store(self, addr: int, val: int):
-        self.mem[self.translate(addr)] = val
+        if self.locked:
+            return
+        offset = self.translate(addr)
+        if self.mem[offset] == val:
+            return
+        self.mem[offset] = val
+        self.generation += 1
+        for observer in self.observers:
+            observer(addr, val)
 
 class Unusable(MemoryRegion):
     name = "unusable"
@@ -52,10 +119,27 @@ class Unusable(MemoryRegion):
     def store(self, addr: int, val: int):
         pass
 
-class ExternalRam(Unimplemented):
+class ExternalRam(MemoryRegion):
+    """cart ram; `data` holds every bank and `mem` is the selected bank's window"""
     name = "external-ram"
+    def __init__(self, lower: int, upper: int, data):
+        self.data = data
+        bank_size = max(min(len(data), upper - lower + 1), 1)
+        view = memoryview(data)
+        self.banks = [view[i:i + bank_size] for i in range(0, len(data), bank_size)]
+        # carts with less than a full window mirror it
+        self.mask = bank_size - 1
+        super().__init__(lower, upper, self.banks[0] if self.banks else None)
+    def select(self, bank: int):
+        if self.banks:
+            self.mem = self.banks[bank % len(self.banks)]
+    def load(self, addr: int) -> int:
+        if not self.banks:
+            return 0xff
+        return self.mem[(addr - self.lower) & self.mask]
     def store(self, addr: int, val: int):
-        return
+        if self.banks:
+            self.mem[(addr - self.lower) & self.mask] = val
 
 class MirrorRam(Unimplemented):
     name = "mirror-ram"
@@ -1,6 +1,7 @@
-from libgb.cart import Cart, MBC3
 from typing import NamedTuple
-from .memory import FixedWorkRam, Unusable
+from . import cart
+from .cart import Cart
+from .memory import FixedWorkRam, Unusable, WatchedRam
 from .io import IOPorts
 from .rom import Rom
 
@@ -23,19 +24,19 @@ class MMU(NamedTuple):
     cart: Cart
     wram: FixedWorkRam
     hram: FixedWorkRam
-    vram: FixedWorkRam
-    oam: FixedWorkRam
+    vram: WatchedRam
+    oam: WatchedRam
     io_ports: IOPorts
 
     @staticmethod
     def from_rom(rom: Rom):
-        cart = MBC3.from_rom(rom)
-        vram = FixedWorkRam(VIDEO_RAM, EXTERNAL_RAM - 1, name="vram")
+        c = cart.from_rom(rom)
+        vram = WatchedRam(VIDEO_RAM, EXTERNAL_RAM - 1, name="vram")
         wram = FixedWorkRam(RAM_BANK_1, RAM_MIRROR - 1, name="wram")
         hram = FixedWorkRam(HIGH_RAM, INT_ENABLE_REG - 1, name="hram")
-        oam = FixedWorkRam(SPRITE_TABLE, UNUSABLE - 1, name="oam")
+        oam = WatchedRam(SPRITE_TABLE, UNUSABLE - 1, name="oam")
         io = IOPorts(IO_PORTS, HIGH_RAM - 1)
-        return MMU(cart, wram, hram, vram, oam, io)
+        return MMU(c, wram, hram, vram, oam, io)
 
     def mem_map(self):
         return list(self)
@@ -55,6 +56,12 @@ class MMU(NamedTuple):
             print("!!! read from 0x{:04x}".format(addr))
             return 0xff
 
+    def view(self, addr: int, size: int):
+        for region in self.mem_map():
+            if addr in region:
+                return region.view(addr, size)
+        return None
+
     def load_nn(self, addr: int) -> int:
         lo = self.load(addr)
         hi = self.load(addr + 1)
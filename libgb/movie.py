@@ -0,0 +1,72 @@
+import struct
+from typing import List, Tuple
+
+from .joypad import InputSource, ScriptedInput
+
+MAGIC = b"GBMV"
+VERSION = 1
+
+# magic, version, sha1 of the rom, number of events
+HEADER = struct.Struct("<4sH20sI")
+# frame the mask changed on, new mask
+EVENT = struct.Struct("<IB")
+
+
+class MovieError(Exception):
+    pass
+
+
+def save(path: str, digest: bytes, events: List[Tuple[int, int]]):
+    parts = [HEADER.pack(MAGIC, VERSION, digest, len(events))]
+    parts.extend(EVENT.pack(frame, mask) for frame, mask in events)
+    with open(path, "wb") as f:
+        f.write(b"".join(parts))
+
+
+def load(path: str, digest: bytes) -> List[Tuple[int, int]]:
+    with open(path, "rb") as f:
+        data = f.read()
+    try:
+        magic, version, movie_digest, count = HEADER.unpack_from(data)
+    except struct.error:
+        raise MovieError("truncated movie")
+    if magic != MAGIC:
+        raise MovieError("not a gb.py movie")
+    if version != VERSION:
+        raise MovieError("unsupported movie version {}".format(version))
+    if movie_digest != digest:
+        raise MovieError("movie was recorded on a different rom")
+    if len(data) != HEADER.size + count * EVENT.size:
+        raise MovieError("truncated movie")
+    return [EVENT.unpack_from(data, HEADER.size + i * EVENT.size) for i in range(count)]
+
+
+class MovieInput(ScriptedInput):
+    """plays back a movie file; JOYP reads index a per-frame mask array"""
+    def __init__(self, path: str, digest: bytes):
+        super().__init__(load(path, digest))
+
+
+class MovieRecorder(InputSource):
+    """passes another source through, keeping the frames its mask changed on
+
+    the source is sampled once per frame, so playing the movie back gives
+    the same JOYP reads as the recorded run.
+    """
+    def __init__(self, source: InputSource):
+        self.source = source
+        self.events: List[Tuple[int, int]] = []
+        self.frame = -1
+        self.last = 0
+
+    def mask(self, frame: int) -> int:
+        if frame != self.frame:
+            self.frame = frame
+            mask = self.source.mask(frame)
+            if mask != self.last:
+                self.events.append((frame, mask))
+                self.last = mask
+        return self.last
+
+    def save(self, path: str, digest: bytes):
+        save(path, digest, self.events)
@@ -1,5 +1,5 @@
 from abc import abstractmethod
-from typing import NamedTuple, Union
+from typing import NamedTuple, Optional, Union
 
 from . import mmu, reg
 
@@ -20,6 +20,8 @@ IMM_TABLE = {
 class Ctx(NamedTuple):
     regs: reg.Regs
     mmu: mmu.MMU
+    # operand bytes already decoded from rom, saves reading them again
+    imm: Optional[int] = None
     def pc(self):
         return self.regs.load(reg.PC)
 
@@ -81,6 +83,8 @@ class Imm(Operand):
     def __init__(self, dword=False):
         self.dword = dword
     def load(self, ctx: Ctx) -> int:
+        if ctx.imm is not None:
+            return ctx.imm
         pc = ctx.pc()
         if self.dword:
             return ctx.mmu.load_nn(pc + 1)
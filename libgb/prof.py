@@ -24,8 +24,18 @@ def init(maxlen=100):
     loop_count = Counter()
     loops = {}
     ngrams = defaultdict(Counter)
+    reset()
 
 
+def reset():
+    # forgets the instructions leading up to now, e.g. after loading a state
+    global loop_start
+    history.clear()
+    loop_start = None
+
+
+init()
+
 def update(op, pc, next_pc, insn):
     global total
     history.appendleft((op, pc, insn))
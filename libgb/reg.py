@@ -77,8 +77,27 @@ REG_FMT = "AF ${:02X}:{:02X}\n" \
 class Regs:
     def __init__(self):
         self._rawregs: RawRegs = defaultdict(int)
-        self.IME = False
+        self._IME = False
         self.halted = False
+        # told when IME changes or EI runs, see CPU.ime_changed / CPU.ei
+        self.listener = None
+
+    @property
+    def IME(self) -> bool:
+        return self._IME
+
+    @IME.setter
+    def IME(self, on: bool):
+        self._IME = on
+        if self.listener is not None:
+            self.listener.ime_changed()
+
+    def ei(self):
+        # with a listener, IME only goes up after the next instruction
+        if self.listener is not None:
+            self.listener.ei()
+        else:
+            self.IME = True
 
     def load(self, reg: Reg) -> int:
         return reg.read(self._rawregs)
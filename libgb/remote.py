@@ -0,0 +1,175 @@
+from multiprocessing import Process, shared_memory
+import time
+from typing import NamedTuple
+
+from .gpu import GPU, make_gpu
+from .io import DisplayIO
+from .joypad import InputSource, KeyboardInput
+from .lcd import HEIGHT, LCD, Sink
+from .memory import WatchedRam
+from .mmu import EXTERNAL_RAM, SPRITE_TABLE, UNUSABLE, VIDEO_RAM
+
+# shared block: a control area, then two frame slots. the emulator fills
+# the slot that isn't `latest` and flips it; each slot has a sequence
+# number that is odd while it's being written, so the renderer can tell
+# a torn copy from a whole one
+LATEST, QUIT, BUTTONS, CLOSED = range(4)
+CONTROL_SIZE = 4 * 8
+
+# gpu registers in the order they're stored in a slot
+REGS = [
+    DisplayIO.LCDC, DisplayIO.STAT, DisplayIO.LY, DisplayIO.SCY, DisplayIO.SCX, DisplayIO.LYC,
+    DisplayIO.BGP, DisplayIO.OBP0, DisplayIO.OBP1, DisplayIO.WY, DisplayIO.WX,
+]
+VRAM_SIZE = EXTERNAL_RAM - VIDEO_RAM
+OAM_SIZE = UNUSABLE - SPRITE_TABLE
+
+# within a slot
+SEQ = 0
+REGS_AT = 8
+SCS_AT = REGS_AT + len(REGS)
+VRAM_AT = SCS_AT + 2 * HEIGHT
+OAM_AT = VRAM_AT + VRAM_SIZE
+SLOT_SIZE = (OAM_AT + OAM_SIZE + 7) & ~7
+SIZE = CONTROL_SIZE + 2 * SLOT_SIZE
+
+TILE_SIZE = 16
+# how long the renderer naps when there's no new frame
+IDLE_SECS = 0.001
+
+
+def slot_at(slot: int) -> int:
+    return CONTROL_SIZE + slot * SLOT_SIZE
+
+
+class RemoteInput(InputSource):
+    """buttons held in the render process's window"""
+    def __init__(self, words):
+        self.words = words
+
+    def mask(self, frame: int) -> int:
+        return self.words[BUTTONS]
+
+
+class RemoteSink(Sink):
+    """hands frames to a render process instead of drawing them
+
+    at VBLANK the emulator only copies vram, oam and the registers the frame
+    depends on into shared memory; composing and presenting happen in the
+    other process, so emulation never waits on SDL.
+    """
+    # the gpu here never composes anything, see vblank
+    wants_frames = False
+
+    def __init__(self, renderer: str = "auto"):
+        self.shm = shared_memory.SharedMemory(create=True, size=SIZE)
+        self.shm.buf[:SIZE] = bytes(SIZE)
+        self.words = self.shm.buf.cast("Q")
+        self.latest = 0
+        self.seqs = [0, 0]
+        self.frames_published = 0
+        self.process = Process(target=render_main, args=(self.shm.name, renderer), daemon=True)
+        self.process.start()
+
+    def draw_display(self, frame: bytearray) -> bool:
+        return self.quit()
+
+    def quit(self) -> bool:
+        return bool(self.words[QUIT]) or not self.process.is_alive()
+
+    def vblank(self, gpu: GPU, mmu) -> bool:
+        if gpu.unchanged(mmu):
+            gpu.frames_skipped += 1
+            return self.quit()
+        slot = 1 - self.latest
+        base = slot_at(slot)
+        buf = self.shm.buf
+        self.seqs[slot] += 1
+        self.words[base // 8 + SEQ] = self.seqs[slot]
+        regs = gpu.regs
+        buf[base + REGS_AT:base + SCS_AT] = bytes(regs[port] for port in REGS)
+        buf[base + SCS_AT:base + VRAM_AT] = bytes(v for sc in gpu.scs for v in sc)
+        buf[base + VRAM_AT:base + OAM_AT] = mmu.vram.mem
+        buf[base + OAM_AT:base + OAM_AT + OAM_SIZE] = mmu.oam.mem
+        self.seqs[slot] += 1
+        self.words[base // 8 + SEQ] = self.seqs[slot]
+        self.words[LATEST] = self.latest = slot
+        self.frames_published += 1
+        return self.quit()
+
+    def inputs(self) -> InputSource:
+        return RemoteInput(self.words)
+
+    def close(self):
+        self.words[CLOSED] = 1
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.words.release()
+        self.shm.close()
+        self.shm.unlink()
+
+
+class Screen(NamedTuple):
+    # the parts of an mmu the gpu draws from
+    vram: WatchedRam
+    oam: WatchedRam
+
+
+def render_main(name: str, renderer: str = "auto"):
+    # started through multiprocessing, so this shares the emulator's
+    # resource tracker and the block stays registered once, to the owner
+    shm = shared_memory.SharedMemory(name=name)
+    words = shm.buf.cast("Q")
+    try:
+        render_loop(shm.buf, words, renderer)
+    finally:
+        words.release()
+        shm.close()
+
+
+def render_loop(buf, words, renderer: str):
+    lcd = LCD()
+    keys = KeyboardInput()
+    screen = Screen(WatchedRam(VIDEO_RAM, EXTERNAL_RAM - 1, name="vram"),
+                    WatchedRam(SPRITE_TABLE, UNUSABLE - 1, name="oam"))
+    gpu = make_gpu(lcd, renderer)
+    gpu.attach(screen)
+    drawn = None
+
+    while not words[CLOSED]:
+        quit = lcd.keep_display()
+        words[BUTTONS] = keys.mask(gpu.frames)
+        slot = words[LATEST]
+        base = slot_at(slot)
+        seq = words[base // 8 + SEQ]
+        if (slot, seq) == drawn or seq & 1:
+            if quit:
+                words[QUIT] = 1
+                return
+            time.sleep(IDLE_SECS)
+            continue
+        data = bytes(buf[base:base + SLOT_SIZE])
+        if words[base // 8 + SEQ] != seq:
+            # the emulator lapped us mid copy
+            continue
+        drawn = (slot, seq)
+
+        vram = data[VRAM_AT:OAM_AT]
+        mem = screen.vram.mem
+        if vram != mem:
+            # tile by tile so the gpu's observers only hear about what changed
+            for lo in range(0, VRAM_SIZE, TILE_SIZE):
+                tile = vram[lo:lo + TILE_SIZE]
+                if tile != mem[lo:lo + TILE_SIZE]:
+                    screen.vram.store_block(VIDEO_RAM + lo, tile)
+        screen.oam.store_block(SPRITE_TABLE, data[OAM_AT:OAM_AT + OAM_SIZE])
+        for port, val in zip(REGS, data[REGS_AT:SCS_AT]):
+            gpu.regs[port] = val
+        scs = data[SCS_AT:VRAM_AT]
+        gpu.scs = list(zip(scs[0::2], scs[1::2]))
+        gpu.frames += 1
+        quit |= bool(gpu.draw_display(screen))
+        if quit:
+            words[QUIT] = 1
+            return
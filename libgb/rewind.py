@@ -0,0 +1,140 @@
+from collections import deque
+import time
+from typing import Deque, NamedTuple
+import zlib
+
+
+class Snapshot(NamedTuple):
+    frame: int
+    keyframe: bool
+    size: int
+    data: bytes  # compressed state, or compressed xor against the previous one
+
+
+def xor(a: bytes, b: bytes) -> bytes:
+    n = max(len(a), len(b))
+    x = int.from_bytes(a, "little") ^ int.from_bytes(b, "little")
+    return x.to_bytes(n, "little")
+
+
+class Rewind:
+    """drives a Gameboy frame by frame, keeping a bounded history to step back into
+
+    every `interval` frames the save state is stored as an xor delta against
+    the previous snapshot (every `keyframe_every` snapshots in full), zlib
+    compressed. inputs are recorded per frame, so stepping back restores the
+    closest snapshot and replays up to the exact frame.
+    """
+    def __init__(self, gb, interval=60, keyframe_every=30, budget=32 * 1024 * 1024):
+        self.gb = gb
+        self.interval = interval
+        self.keyframe_every = keyframe_every
+        self.budget = budget
+
+        self.snapshots: Deque[Snapshot] = deque()
+        self.since_keyframe = 0
+        self.prev = b""
+        self.used = 0
+
+        self.inputs = bytearray()
+        self.input_base = gb.gpu.frames
+
+        self.captures = 0
+        self.capture_secs = 0.0
+        self.frames_run = 0
+
+    def run_frame(self) -> bool:
+        gb = self.gb
+        frame = gb.gpu.frames
+        if not self.snapshots or (frame % self.interval == 0 and self.snapshots[-1].frame != frame):
+            self.capture()
+        self.frames_run += 1
+
+        # inputs are latched per frame so replays are exact
+        gb.joypad.forced = None
+        mask = gb.joypad.poll()
+        del self.inputs[frame - self.input_base:]
+        self.inputs.append(mask)
+        return self.play_frame(mask)
+
+    def play_frame(self, mask: int) -> bool:
+        self.gb.joypad.forced = mask
+        return self.gb.run_frames(1)
+
+    def capture(self):
+        start = time.perf_counter()
+        state = self.gb.save_state()
+        keyframe = self.since_keyframe == 0 or not self.snapshots
+        if keyframe:
+            data = zlib.compress(state, 1)
+        else:
+            data = zlib.compress(xor(self.prev, state), 1)
+        self.since_keyframe = (self.since_keyframe + 1) % self.keyframe_every
+        self.prev = state
+
+        self.snapshots.append(Snapshot(self.gb.gpu.frames, keyframe, len(state), data))
+        self.used += len(data)
+        self.evict()
+
+        self.captures += 1
+        self.capture_secs += time.perf_counter() - start
+
+    def evict(self):
+        while self.used > self.budget and len(self.snapshots) > 1:
+            # drop the oldest keyframe together with the deltas that need it
+            self.used -= len(self.snapshots.popleft().data)
+            while self.snapshots and not self.snapshots[0].keyframe:
+                self.used -= len(self.snapshots.popleft().data)
+        if self.snapshots:
+            first = self.snapshots[0].frame
+            del self.inputs[:first - self.input_base]
+            self.input_base = first
+
+    def restore(self, idx: int) -> bytes:
+        key = idx
+        while not self.snapshots[key].keyframe:
+            key -= 1
+        state = zlib.decompress(self.snapshots[key].data)
+        for snapshot in list(self.snapshots)[key + 1:idx + 1]:
+            state = xor(state, zlib.decompress(snapshot.data))[:snapshot.size]
+        return state
+
+    def step_back(self, frames: int) -> int:
+        # returns the frame actually reached
+        target = max(self.gb.gpu.frames - frames, self.input_base)
+        if not self.snapshots:
+            return self.gb.gpu.frames
+
+        idx = len(self.snapshots) - 1
+        while idx > 0 and self.snapshots[idx].frame > target:
+            idx -= 1
+        state = self.restore(idx)
+        self.gb.load_state(state)
+
+        # the future is gone: later snapshots no longer apply
+        while len(self.snapshots) > idx + 1:
+            self.used -= len(self.snapshots.pop().data)
+        self.prev = state
+        self.since_keyframe = (idx - self.last_keyframe() + 1) % self.keyframe_every
+
+        while self.gb.gpu.frames < target:
+            if self.play_frame(self.inputs[self.gb.gpu.frames - self.input_base]):
+                break
+        del self.inputs[self.gb.gpu.frames - self.input_base:]
+        return self.gb.gpu.frames
+
+    def last_keyframe(self) -> int:
+        idx = len(self.snapshots) - 1
+        while not self.snapshots[idx].keyframe:
+            idx -= 1
+        return idx
+
+    def stats(self):
+        return {
+            "snapshots": len(self.snapshots),
+            "keyframes": sum(s.keyframe for s in self.snapshots),
+            "history_frames": self.gb.gpu.frames - self.input_base,
+            "bytes": self.used + len(self.inputs),
+            "ms_per_capture": self.capture_secs * 1000 / max(self.captures, 1),
+            "ms_per_frame": self.capture_secs * 1000 / max(self.frames_run, 1),
+        }
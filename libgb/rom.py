@@ -1,5 +1,6 @@
 from enum import Enum
-from typing import NamedTuple
+import mmap
+from typing import NamedTuple, Optional
 
 TITLE_START_OFFSET = 0x134
 TITLE_END_OFFSET = 0x143
@@ -41,6 +42,16 @@ class CartridgeType(Enum):
     HuC1_RAM_BATTERY = 0xFF
 
 
+RAM_SIZES = {
+    0x00: 0,
+    0x01: 0x800,
+    0x02: 0x2000,
+    0x03: 0x8000,
+    0x04: 0x20000,
+    0x05: 0x10000,
+}
+
+
 class CGBSupport(Enum):
     GB = -1
     CGB_ENHANCED = 0x80
@@ -71,14 +82,49 @@ class Header(NamedTuple):
 
         return Header(title, cart_type, rom_code, ram_code, cgb)
 
-class Rom(NamedTuple):
+    def ram_size(self) -> int:
+        return RAM_SIZES.get(self.ram_code, 0)
+
+    def has_battery(self) -> bool:
+        return "BATTERY" in self.cart_type.name
+
+    def has_timer(self) -> bool:
+        return "TIMER" in self.cart_type.name
+
+BANK_SIZE = 0x4000
+
+
+class Rom:
     header: Header
     data: bytes
+    path: Optional[str]
+    file: Optional[str]
+
+    def __init__(self, header: Header, data: bytes, path: Optional[str] = None,
+                 file: Optional[str] = None):
+        self.header = header
+        self.data = data
+        # where .sav files go; cleared to keep them out of a run
+        self.path = path
+        # the file the rom was read from, for other processes to load
+        self.file = path if file is None else file
+        view = memoryview(data)
+        self.banks = [view[i:i + BANK_SIZE] for i in range(0, len(data), BANK_SIZE)]
+        self._digest = None
+
+    @property
+    def digest(self) -> bytes:
+        # hashed on first use so loading doesn't touch every page
+        if self._digest is None:
+            import hashlib
+            self._digest = hashlib.sha1(self.data).digest()
+        return self._digest
 
     @staticmethod
     def from_file(path: str):
+        # mapped read-only: processes running the same rom share its pages
         with open(path, "rb") as f:
-            data = f.read()
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
         header = Header.from_rom(data)
 
-        return Rom(header, data)
+        return Rom(header, data, path)
@@ -0,0 +1,117 @@
+import struct
+import time
+from typing import Callable, List, Optional
+
+# S M H DL DH, registers are selected with ram banks 08-0C
+NUM_REGS = 5
+DH_DAY_HI = 1 << 0
+DH_HALT = 1 << 6
+DH_CARRY = 1 << 7
+
+SECS_PER_DAY = 24 * 60 * 60
+MAX_DAYS = 512
+
+# saved after the cart ram like bgb/vba: current and latched registers as
+# 32 bit words, then the unix time they were written at
+BLOCK = struct.Struct("<5I5Iq")
+RTC_SIZE = BLOCK.size
+
+
+def to_regs(total: int, carry: bool) -> List[int]:
+    days, secs = divmod(total, SECS_PER_DAY)
+    dh = (days >> 8) & DH_DAY_HI
+    if carry:
+        dh |= DH_CARRY
+    return [secs % 60, secs // 60 % 60, secs // 3600, days & 0xff, dh]
+
+
+def from_regs(regs: List[int]) -> int:
+    s, m, h, dl, dh = regs
+    days = ((dh & DH_DAY_HI) << 8) | dl
+    return (((days * 24) + (h & 0x1f)) * 60 + (m & 0x3f)) * 60 + (s & 0x3f)
+
+
+class Rtc:
+    """mbc3 clock, derived from a base time instead of being ticked
+
+    the counter is `clock() - base` seconds, so nothing happens between
+    latches. `clock` is emulated time unless the cart is attached to the
+    wall clock.
+    """
+    def __init__(self, block: memoryview):
+        self.block = block
+        self.clock: Callable[[], float] = lambda: 0.0
+        self.base = 0.0
+        # counter value while halted
+        self.frozen: Optional[float] = None
+        self.carry = False
+        self.latched = [0] * NUM_REGS
+
+    def attach(self, clock: Callable[[], float], wall_clock: bool = False):
+        self.clock = clock
+        vals = BLOCK.unpack_from(self.block)
+        regs, latched, stamp = list(vals[:NUM_REGS]), list(vals[NUM_REGS:-1]), vals[-1]
+        if not stamp:
+            # nothing saved yet
+            self.set_counter(0)
+            return
+        total = from_regs(regs)
+        halted = regs[4] & DH_HALT
+        if wall_clock and not halted:
+            # the real clock kept running while we were off
+            total += max(time.time() - stamp, 0)
+        self.carry = bool(regs[4] & DH_CARRY)
+        self.latched = [v & 0xff for v in latched]
+        self.frozen = None
+        self.set_counter(total)
+        if halted:
+            self.frozen = self.counter()
+
+    def counter(self) -> float:
+        if self.frozen is not None:
+            return self.frozen
+        total = self.clock() - self.base
+        if total >= MAX_DAYS * SECS_PER_DAY:
+            # the day counter overflowed; wrap and keep the carry until cleared
+            self.carry = True
+            total %= MAX_DAYS * SECS_PER_DAY
+            self.base = self.clock() - total
+        return total
+
+    def set_counter(self, total: float):
+        if self.frozen is not None:
+            self.frozen = total
+        else:
+            self.base = self.clock() - total
+
+    def regs(self) -> List[int]:
+        regs = to_regs(int(self.counter()), self.carry)
+        if self.frozen is not None:
+            regs[4] |= DH_HALT
+        return regs
+
+    def latch(self):
+        self.latched = self.regs()
+        self.sync()
+
+    def load(self, idx: int) -> int:
+        return self.latched[idx]
+
+    def store(self, idx: int, val: int):
+        regs = self.regs()
+        regs[idx] = val
+        self.latched[idx] = val
+        if idx == 4:
+            self.carry = bool(val & DH_CARRY)
+            if val & DH_HALT and self.frozen is None:
+                self.frozen = self.counter()
+            elif not val & DH_HALT and self.frozen is not None:
+                self.frozen = None
+        # writing the registers also resets the sub-second counter
+        self.set_counter(from_regs(regs))
+        self.sync()
+
+    def sync(self):
+        # done on latches and writes, and by the cart on state saves, .sav
+        # flushes and shutdown; the counter itself is never stored
+        BLOCK.pack_into(self.block, 0, *self.regs(), *self.latched, int(time.time()))
@@ -0,0 +1,57 @@
+from typing import Callable, Dict, Set
+
+NEVER = float("inf")
+
+
+class Scheduler:
+    """named one-shot events, due at an absolute tick count"""
+    now: int
+    events: Dict[str, int]
+    def __init__(self):
+        self.now = 0
+        self.handlers: Dict[str, Callable[[], None]] = {}
+        self.events = {}
+        self.next_event = NEVER
+        # events that belong to the host rather than the emulated machine
+        self.host: Set[str] = set()
+
+    def register(self, name: str, handler: Callable[[], None], host: bool = False):
+        # host events (link cable syncs and the like) aren't saved in states,
+        # and loading one leaves them pending with the delay they had left
+        self.handlers[name] = handler
+        if host:
+            self.host.add(name)
+
+    def schedule(self, name: str, delay: int):
+        # (re)schedules the event, replacing any pending one of the same name
+        due = self.now + delay
+        self.events[name] = due
+        self.next_event = min(self.next_event, due)
+
+    def cancel(self, name: str):
+        if self.events.pop(name, None) is not None:
+            self.next_event = min(self.events.values(), default=NEVER)
+
+    def pending(self, name: str) -> bool:
+        return name in self.events
+
+    def tick(self):
+        self.now += 1
+        if self.now >= self.next_event:
+            self.run_due()
+
+    def advance(self, ticks: int):
+        # same as `ticks` calls to tick: every event runs on its own tick
+        end = self.now + ticks
+        while self.next_event <= end and self.now < end:
+            self.now = max(self.next_event, self.now + 1)
+            self.run_due()
+        self.now = end
+
+    def run_due(self):
+        due = sorted((t, name) for name, t in self.events.items() if t <= self.now)
+        for _, name in due:
+            del self.events[name]
+        self.next_event = min(self.events.values(), default=NEVER)
+        for _, name in due:
+            self.handlers[name]()
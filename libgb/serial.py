@@ -1,23 +1,70 @@
+from typing import Callable, List
+
+from .cpu import CPU, CPU_CLOCK, Interrupt
 from .io import IOHandler, SerialIO
+from .sched import Scheduler
 
 SERIAL_IO_PORTS = [e.value for e in SerialIO.__members__.values()]
 
 TRANSFER_START_FLAG = 1 << 7
+INTERNAL_CLOCK_FLAG = 1 << 0
+# unused SC bits read back as 1
+SC_UNUSED = 0x7E
+
+SERIAL_HZ = 8192
+# 8 bits shifted out at 8192Hz
+TRANSFER_TICKS = 8 * (CPU_CLOCK // SERIAL_HZ)
+# nothing is plugged in, so every bit shifted in is 1
+NO_PARTNER = 0xFF
+
 
 class SerialIOHandler(IOHandler):
     sb: int
     sc: int
-    def __init__(self):
+    def __init__(self, cpu: CPU, sched: Scheduler):
         self.sb = 0
         self.sc = 0
+        self.cpu = cpu
+        self.sched = sched
+        sched.register("serial", self.transfer_done)
+        # every byte sent, and callbacks streaming them as they complete
+        self.output = bytearray()
+        self.observers: List[Callable[[int], None]] = []
+        # see link.Link, None when nothing is plugged in
+        self.link = None
     def __contains__(self, addr: int) -> bool:
         return addr in SERIAL_IO_PORTS
     def load(self, addr: int) -> int:
-        return 0
+        if addr == SerialIO.SB.value:
+            return self.sb
+        return self.sc | SC_UNUSED
     def store(self, addr: int, val: int):
         if addr == SerialIO.SB.value:
             self.sb = val
         if addr == SerialIO.SC.value:
             self.sc = val
-            if val & TRANSFER_START_FLAG:
-                print(chr(self.sb), end="")
+            # external clock transfers only finish when a linked gameboy clocks them
+            if val & TRANSFER_START_FLAG and val & INTERNAL_CLOCK_FLAG:
+                self.sched.schedule("serial", TRANSFER_TICKS)
+                if self.link is not None:
+                    self.link.send(self.sb, self.sched.now + TRANSFER_TICKS)
+            else:
+                self.sched.cancel("serial")
+    def transfer_done(self):
+        val = self.sb
+        received = self.link.finish() if self.link is not None else None
+        self.sb = NO_PARTNER if received is None else received
+        self.complete(val)
+    def receive(self, val: int) -> int:
+        # the other side clocked a byte in, ours goes back
+        sent = self.sb
+        self.sb = val
+        if self.sc & TRANSFER_START_FLAG and not self.sc & INTERNAL_CLOCK_FLAG:
+            self.complete(sent)
+        return sent
+    def complete(self, val: int):
+        self.output.append(val)
+        self.sc &= ~TRANSFER_START_FLAG
+        self.cpu.request_interrupt(Interrupt.SERIAL)
+        for observer in self.observers:
+            observer(val)
@@ -0,0 +1,190 @@
+import struct
+from typing import List
+
+from . import prof, reg
+
+MAGIC = b"GBPY"
+VERSION = 6
+
+HEADER = struct.Struct("<4sH20s")
+# A F B C D E H L, PC SP, IME halted IF IE, cycles execs
+CPU_STATE = struct.Struct("<8B2H4B2Q")
+CPU_REGS = [reg.A, reg.F, reg.B, reg.C, reg.D, reg.E, reg.H, reg.L, reg.PC, reg.SP]
+SCHED_STATE = struct.Struct("<QB")
+EVENT = struct.Struct("<B16sQ")
+# number of bank registers (see Cart.REGS), ram size
+CART_STATE = struct.Struct("<BI")
+CART_REG = struct.Struct("<Q")
+# has rtc, counter secs, halted, carry, latched S M H DL DH
+RTC_STATE = struct.Struct("<?d??5B")
+GPU_STATE = struct.Struct("<11BHQ")
+# div tima tma tac ticks
+TIMER_STATE = struct.Struct("<4BQ")
+# joypad mode, joypad mask, sb, sc, oam locked
+IO_STATE = struct.Struct("<5B")
+
+
+class StateError(Exception):
+    pass
+
+
+def save(gb) -> bytes:
+    cpu, regs = gb.cpu, gb.cpu.regs
+    parts: List[bytes] = [HEADER.pack(MAGIC, VERSION, gb.rom.digest)]
+
+    parts.append(CPU_STATE.pack(
+        *(regs.load(r) for r in CPU_REGS),
+        regs.IME, regs.halted, cpu.if_vector, cpu.ie_vector,
+        cpu.cycles, cpu.execs,
+    ))
+
+    sched = gb.sched
+    events = {name: due for name, due in sched.events.items() if name not in sched.host}
+    parts.append(SCHED_STATE.pack(sched.now, len(events)))
+    parts.extend(EVENT.pack(len(name), name.encode(), due) for name, due in events.items())
+
+    mmu = gb.mmu
+    parts.extend([mmu.vram.mem, mmu.wram.mem, mmu.hram.mem, mmu.oam.mem])
+
+    cart = mmu.cart
+    parts.append(CART_STATE.pack(len(cart.REGS), len(cart.ram.data)))
+    parts.extend(CART_REG.pack(getattr(cart, name)) for name in cart.REGS)
+    parts.append(cart.ram.data)
+    rtc = cart.rtc
+    if rtc is None:
+        parts.append(RTC_STATE.pack(False, 0.0, False, False, *[0] * 5))
+    else:
+        # keeps the .sav's clock as current as the state's
+        rtc.sync()
+        parts.append(RTC_STATE.pack(True, rtc.counter(), rtc.frozen is not None, rtc.carry, *rtc.latched))
+
+    gpu = gb.gpu
+    parts.append(GPU_STATE.pack(*gpu.regs.values(), gpu.next_ly, gpu.frames))
+    parts.append(bytes(v for sc in gpu.scs for v in sc))
+
+    t = gb.timer
+    parts.append(TIMER_STATE.pack(t.div, t.tima, t.tma, t.tac, t.ticks))
+    parts.append(IO_STATE.pack(gb.joypad.mode, gb.joypad.mask, gb.serial.sb, gb.serial.sc, mmu.oam.locked))
+
+    return b"".join(parts)
+
+
+class Reader:
+    def __init__(self, data: bytes):
+        self.data = memoryview(data)
+        self.offset = 0
+
+    def unpack(self, fmt: struct.Struct):
+        vals = fmt.unpack_from(self.data, self.offset)
+        self.offset += fmt.size
+        return vals
+
+    def raw(self, size: int) -> memoryview:
+        data = self.data[self.offset:self.offset + size]
+        if len(data) != size:
+            raise StateError("truncated state")
+        self.offset += size
+        return data
+
+
+def load(gb, data: bytes):
+    r = Reader(data)
+    try:
+        magic, version, digest = r.unpack(HEADER)
+    except struct.error:
+        raise StateError("truncated state")
+    if magic != MAGIC:
+        raise StateError("not a gb.py save state")
+    if version != VERSION:
+        raise StateError("unsupported state version {}".format(version))
+    if digest != gb.rom.digest:
+        raise StateError("state was saved from a different rom")
+
+    try:
+        load_parts(gb, r)
+    except struct.error:
+        raise StateError("truncated state")
+    # the profiler's loop tracking followed the execution that was replaced
+    prof.reset()
+
+
+def load_parts(gb, r: Reader):
+    # everything is read and checked before anything is touched, so a bad
+    # state leaves the running emulator as it was
+    cpu_vals = r.unpack(CPU_STATE)
+
+    sched = gb.sched
+    now, n_events = r.unpack(SCHED_STATE)
+    events = []
+    for _ in range(n_events):
+        size, name, due = r.unpack(EVENT)
+        name = name[:size].decode()
+        # e.g. the link cable's events from states saved before they were
+        # host events, in an instance with or without a cable
+        if name in sched.handlers and name not in sched.host:
+            events.append((name, due))
+
+    mmu = gb.mmu
+    regions = [mmu.vram, mmu.wram, mmu.hram, mmu.oam]
+    mems = [r.raw(region.size) for region in regions]
+
+    cart = mmu.cart
+    n_regs, ram_size = r.unpack(CART_STATE)
+    if n_regs != len(cart.REGS) or ram_size != len(cart.ram.data):
+        raise StateError("cart mismatch")
+    cart_regs = [r.unpack(CART_REG)[0] for _ in cart.REGS]
+    ram = r.raw(ram_size)
+    has_rtc, counter, rtc_halted, carry, *latched = r.unpack(RTC_STATE)
+    rtc = cart.rtc
+    if has_rtc != (rtc is not None):
+        raise StateError("cart mismatch")
+
+    gpu = gb.gpu
+    gpu_vals = r.unpack(GPU_STATE)
+    scs = r.raw(len(gpu.scs) * 2)
+    timer_vals = r.unpack(TIMER_STATE)
+    mode, mask, sb, sc, oam_locked = r.unpack(IO_STATE)
+
+    cpu, regs = gb.cpu, gb.cpu.regs
+    for reg_, val in zip(CPU_REGS, cpu_vals):
+        regs.store(reg_, val)
+    ime, halted, cpu.if_vector, cpu.ie_vector, cpu.cycles, cpu.execs = cpu_vals[len(CPU_REGS):]
+    regs.IME, regs.halted = bool(ime), bool(halted)
+
+    host = [(name, due - sched.now) for name, due in sched.events.items() if name in sched.host]
+    sched.now = now
+    sched.events.clear()
+    sched.next_event = float("inf")
+    for name, due in events:
+        sched.schedule(name, due - now)
+    for name, delay in host:
+        sched.schedule(name, delay)
+
+    for region, mem in zip(regions, mems):
+        region.mem[:] = mem
+        region.touch()
+
+    for name, val in zip(cart.REGS, cart_regs):
+        setattr(cart, name, val)
+    cart.ram.data[:] = ram
+    cart.update_windows()
+    if rtc is not None:
+        rtc.frozen = counter if rtc_halted else None
+        rtc.set_counter(counter)
+        rtc.carry, rtc.latched = carry, latched
+
+    for port, val in zip(list(gpu.regs), gpu_vals):
+        gpu.regs[port] = val
+    gpu.next_ly, gpu.frames = gpu_vals[-2:]
+    gpu.scs = [(scs[i], scs[i + 1]) for i in range(0, len(scs), 2)]
+    gpu.invalidate(mmu)
+
+    t = gb.timer
+    t.div, t.tima, t.tma, t.tac, t.ticks = timer_vals
+    joypad = gb.joypad
+    joypad.mode, gb.serial.sb, gb.serial.sc = mode, sb, sc
+    joypad.set_mask(mask)
+    # no line was high before, so recomputing them can't raise an interrupt
+    joypad.lines = 0
+    joypad.update()
+    mmu.oam.locked = bool(oam_locked)
@@ -0,0 +1,122 @@
+import marshal
+import os
+import sys
+from typing import Any, Dict, Hashable, Iterable, Optional, Tuple
+
+from .rom import Rom
+
+# where caches live unless GBPY_CACHE_DIR says otherwise; an empty
+# GBPY_CACHE_DIR keeps caches in memory only
+DEFAULT_ROOT = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "gb.py")
+VERSION = 1
+
+# (file offset, bytes the entry was built from)
+Fingerprint = Tuple[Tuple[int, bytes], ...]
+
+
+def cache_root() -> Optional[str]:
+    return os.environ.get("GBPY_CACHE_DIR", DEFAULT_ROOT) or None
+
+
+class TranslationCache:
+    """decode/translation results that outlive the process
+
+    one file per rom, named after the sha1 of its bytes. every entry keeps
+    the rom bytes it was derived from, and entries whose bytes no longer
+    match are dropped on load. values must be marshallable (code objects
+    included), and the file is only reused by the same python version.
+
+    nothing is hashed or read until an entry is first looked at, so a
+    cache nobody uses costs nothing at startup.
+    """
+    def __init__(self, rom: Rom, root: Optional[str] = None):
+        self.rom = rom
+        # None keeps the cache in memory only
+        self.root = root
+        self._entries: Optional[Dict[Hashable, Tuple[Fingerprint, Any]]] = None
+        self.dirty = False
+        # stale entries thrown away by the last load
+        self.dropped = 0
+
+    @staticmethod
+    def open(rom: Rom, root: Optional[str] = None):
+        if root is None:
+            root = cache_root()
+        return TranslationCache(rom, root)
+
+    @property
+    def path(self) -> Optional[str]:
+        if self.root is None:
+            return None
+        return os.path.join(self.root, self.rom.digest.hex() + ".marshal")
+
+    @property
+    def entries(self) -> Dict[Hashable, Tuple[Fingerprint, Any]]:
+        if self._entries is None:
+            self._entries = {}
+            self.load()
+        return self._entries
+
+    def fingerprint(self, spans: Iterable[Tuple[int, int]]) -> Fingerprint:
+        # spans are (file offset, length) pairs of rom bytes
+        data = self.rom.data
+        return tuple((offset, bytes(data[offset:offset + size])) for offset, size in spans)
+
+    def valid(self, fingerprint: Fingerprint) -> bool:
+        data = self.rom.data
+        return all(data[offset:offset + len(raw)] == raw for offset, raw in fingerprint)
+
+    def get(self, key: Hashable, default=None):
+        entry = self.entries.get(key)
+        return default if entry is None else entry[1]
+
+    def put(self, key: Hashable, value, spans: Iterable[Tuple[int, int]] = ()):
+        self.entries[key] = (self.fingerprint(spans), value)
+        self.dirty = True
+
+    def drop(self, key: Hashable):
+        if self.entries.pop(key, None) is not None:
+            self.dirty = True
+
+    def load(self):
+        # merges what's on disk into what's in memory, which wins
+        if self._entries is None:
+            self._entries = {}
+        path = self.path
+        if path is None or not os.path.exists(path):
+            return
+        try:
+            with open(path, "rb") as f:
+                version, tag, entries = marshal.load(f)
+        except (OSError, EOFError, ValueError, TypeError):
+            # unreadable caches are rebuilt, never fatal
+            return
+        if version != VERSION or tag != sys.implementation.cache_tag:
+            return
+        for key, (fingerprint, value) in entries.items():
+            if key in self.entries:
+                continue
+            if self.valid(fingerprint):
+                self.entries[key] = (fingerprint, value)
+            else:
+                self.dropped += 1
+                self.dirty = True
+
+    def save(self):
+        # only a cache that was used can be dirty, so this never hashes for nothing
+        if self.root is None or not self.dirty:
+            return
+        path = self.path
+        # keep whatever other processes saved in the meantime
+        self.load()
+        # written aside and renamed so concurrent runs never see half a file
+        tmp = "{}.{}.tmp".format(path, os.getpid())
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            with open(tmp, "wb") as f:
+                marshal.dump((VERSION, sys.implementation.cache_tag, self.entries), f)
+            os.replace(tmp, path)
+        except OSError as e:
+            print("! couldn't save translation cache: {}".format(e))
+            return
+        self.dirty = False
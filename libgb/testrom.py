@@ -0,0 +1,39 @@
+import re
+from typing import Optional, Pattern
+
+from .serial import SerialIOHandler
+
+# blargg's test roms report over the serial port
+PASSED = re.compile(rb"Passed")
+FAILED = re.compile(rb"Failed")
+# patterns only need to be found near the end of the output
+TAIL = 256
+
+
+class SerialVerdict:
+    """watches serial output for a pass/fail pattern"""
+    def __init__(self, serial: SerialIOHandler, passed: Pattern = PASSED, failed: Pattern = FAILED):
+        self.serial = serial
+        self.passed = passed
+        self.failed = failed
+        self.result: Optional[str] = None
+        serial.observers.append(self.received)
+
+    def received(self, val: int):
+        if self.result is not None:
+            return
+        tail = bytes(self.serial.output[-TAIL:])
+        if self.failed.search(tail):
+            self.result = "failed"
+        elif self.passed.search(tail):
+            self.result = "passed"
+
+
+def run_test_rom(gb, max_cycles: int = None, verdict: SerialVerdict = None) -> str:
+    # "passed" / "failed" as soon as the output says so, else "timeout" or "stopped"
+    if verdict is None:
+        verdict = SerialVerdict(gb.serial)
+    limit = max_cycles or float("inf")
+    if not gb.run_until(lambda gb: verdict.result is not None or gb.sched.now >= limit):
+        return verdict.result or "stopped"
+    return verdict.result or "timeout"
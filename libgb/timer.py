@@ -1,4 +1,3 @@
-from libgb.instr import ret
 from .cpu import CPU, CPU_CLOCK, Interrupt
 from .io import IOHandler, TimerIO
 
@@ -56,6 +55,29 @@ class Timer:
                 cpu.request_interrupt(Interrupt.TIMER)
                 self.tima = self.tma
 
+    def advance(self, cpu: CPU, ticks: int):
+        # same as `ticks` calls to step
+        start = self.ticks
+        self.ticks += ticks
+        divs = self.ticks // DIV_TICKS - start // DIV_TICKS
+        if divs:
+            self.div = (self.div + divs) & 0xff
+        if not self.is_running():
+            return
+        period = MODE_TICKS[self.get_mode()]
+        for _ in range(self.ticks // period - start // period):
+            self.tima += 1
+            if self.tima > 0xff:
+                cpu.request_interrupt(Interrupt.TIMER)
+                self.tima = self.tma
+
+    def until_tima(self) -> float:
+        # ticks until tima next counts up
+        if not self.is_running():
+            return float("inf")
+        period = MODE_TICKS[self.get_mode()]
+        return period - self.ticks % period
+
 
 class TimerIOHandler(IOHandler):
     def __init__(self, timer: Timer):
@@ -0,0 +1,133 @@
+from multiprocessing import Pipe, Process, shared_memory
+from typing import Iterable, List
+
+import numpy as np
+
+from .gameboy import Gameboy
+from .lcd import FRAME_SIZE, HEIGHT, WIDTH, BufferSink
+from .rom import Rom
+
+
+class VecGameboy:
+    """N gameboys stepped a frame at a time in lockstep
+
+    step() takes one button mask per instance (see JoypadIOHandler.forced)
+    and returns the (N, 144, 160) uint8 array of shades, which every
+    instance's sink writes into directly: nothing is allocated per step.
+    """
+    def __init__(self, rom: Rom, n: int, renderer: str = "auto", obs: np.ndarray = None):
+        self.obs = np.zeros((n, HEIGHT, WIDTH), dtype=np.uint8) if obs is None else obs
+        assert self.obs.shape == (n, HEIGHT, WIDTH) and self.obs.dtype == np.uint8
+        self.dones = np.zeros(n, dtype=bool)
+
+        # without a path every instance gets its own cart ram instead of
+        # sharing one .sav; the rom pages themselves are shared
+        rom = Rom(rom.header, rom.data, file=rom.file)
+        self.gbs: List[Gameboy] = []
+        for i in range(n):
+            sink = BufferSink(memoryview(self.obs[i]).cast("B"))
+            self.gbs.append(Gameboy.from_rom(rom, sink, renderer))
+        self.initial = [gb.save_state() for gb in self.gbs]
+
+    def __len__(self) -> int:
+        return len(self.gbs)
+
+    def step(self, actions) -> np.ndarray:
+        dones = self.dones
+        for i, gb in enumerate(self.gbs):
+            gb.joypad.forced = int(actions[i])
+            dones[i] = gb.run_frames(1)
+        return self.obs
+
+    def reset(self, indices: Iterable[int] = None) -> np.ndarray:
+        if indices is None:
+            indices = range(len(self.gbs))
+        for i in indices:
+            self.gbs[i].load_state(self.initial[i])
+            self.obs[i] = 0
+            self.dones[i] = False
+        return self.obs
+
+
+def shared_arrays(buf, n: int):
+    # obs, actions, dones laid out back to back in one block
+    obs = np.ndarray((n, HEIGHT, WIDTH), dtype=np.uint8, buffer=buf)
+    actions = np.ndarray(n, dtype=np.uint8, buffer=buf, offset=n * FRAME_SIZE)
+    dones = np.ndarray(n, dtype=bool, buffer=buf, offset=n * (FRAME_SIZE + 1))
+    return obs, actions, dones
+
+
+def shard_worker(conn, rom_path: str, renderer: str, name: str, n: int, lo: int, hi: int):
+    # workers share the parent's resource tracker, which unlinks the block
+    shm = shared_memory.SharedMemory(name=name)
+    obs, actions, dones = shared_arrays(shm.buf, n)
+    env = VecGameboy(Rom.from_file(rom_path), hi - lo, renderer, obs[lo:hi])
+
+    while True:
+        cmd = conn.recv()
+        if cmd == "step":
+            env.step(actions[lo:hi])
+            dones[lo:hi] = env.dones
+        elif cmd == "reset":
+            env.reset()
+            dones[lo:hi] = False
+        else:
+            break
+        conn.send(None)
+
+    del env, obs, actions, dones
+    shm.close()
+
+
+class ShardedVecGameboy:
+    """VecGameboy split across worker processes
+
+    observations, actions and done flags live in one shared memory block,
+    so workers write frames where the caller reads them and only a short
+    command goes over each pipe per step.
+    """
+    def __init__(self, rom_path: str, n: int, workers: int, renderer: str = "auto"):
+        workers = max(min(workers, n), 1)
+        self.shm = shared_memory.SharedMemory(create=True, size=n * (FRAME_SIZE + 2))
+        self.obs, self.actions, self.dones = shared_arrays(self.shm.buf, n)
+        self.obs[:] = 0
+        self.dones[:] = False
+
+        self.conns = []
+        self.procs = []
+        bounds = [n * w // workers for w in range(workers + 1)]
+        for lo, hi in zip(bounds, bounds[1:]):
+            conn, child = Pipe()
+            proc = Process(target=shard_worker, args=(child, rom_path, renderer, self.shm.name, n, lo, hi),
+                           daemon=True)
+            proc.start()
+            self.conns.append(conn)
+            self.procs.append(proc)
+
+    def __len__(self) -> int:
+        return len(self.actions)
+
+    def command(self, cmd: str):
+        for conn in self.conns:
+            conn.send(cmd)
+        for conn in self.conns:
+            conn.recv()
+
+    def step(self, actions) -> np.ndarray:
+        self.actions[:] = actions
+        self.command("step")
+        return self.obs
+
+    def reset(self) -> np.ndarray:
+        self.command("reset")
+        self.obs[:] = 0
+        return self.obs
+
+    def close(self):
+        for conn in self.conns:
+            conn.send("close")
+        for proc in self.procs:
+            proc.join()
+        del self.obs, self.actions, self.dones
+        self.shm.close()
+        self.shm.unlink()